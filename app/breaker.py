@@ -0,0 +1,126 @@
+import asyncio
+import logging
+import time
+
+from aioredis.exceptions import RedisError
+
+from app import metrics
+from environ import REDIS_BREAKER_FAILURES, REDIS_BREAKER_RESET
+
+
+logger = logging.getLogger(__name__)
+
+
+CLOSED = 'closed'
+HALF_OPEN = 'half_open'
+OPEN = 'open'
+
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class BreakerError(Exception):
+    """The protected call was rejected by the open circuit or has failed"""
+
+
+class CircuitBreaker:
+    """Stops calling a failing dependency. After failure_threshold consecutive
+    errors calls are rejected for reset_timeout seconds, then a single trial
+    call is let through and its outcome closes or reopens the circuit.
+    Callbacks registered with on_recover run whenever calls succeed again
+    after failures"""
+
+    def __init__(self, name: str, failure_threshold: int, reset_timeout: float,
+                 errors: tuple = (Exception,)):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.errors = errors
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.recover_callbacks = []
+        self.stats = {'opened': 0, 'rejected': 0, 'failed': 0}
+        self._tasks = set()
+
+    def allow(self) -> bool:
+        """Whether a call may go through now. Moves an open circuit whose
+        timeout has passed to half-open, letting the caller make the trial call"""
+
+        if self.state == CLOSED:
+            return True
+        if self.state == OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+            self.state = HALF_OPEN
+            return True
+        return False
+
+    async def call(self, func, *args, **kwargs):
+        """Await func(*args, **kwargs) unless the circuit is open. Rejections
+        and failures are raised as BreakerError"""
+
+        if not self.allow():
+            self.stats['rejected'] += 1
+            raise BreakerError(f'{self.name} circuit is open')
+
+        try:
+            result = await func(*args, **kwargs)
+        except self.errors as e:
+            self.record_failure()
+            raise BreakerError(f'{self.name} call failed: {e!r}') from e
+        except BaseException:
+            # a cancelled trial must not leave the circuit half-open forever
+            if self.state == HALF_OPEN:
+                self.open()
+            raise
+
+        self.record_success()
+        return result
+
+    def open(self):
+        if self.state != OPEN:
+            self.stats['opened'] += 1
+            logger.warning('%s circuit opened after %d failures', self.name, self.failures)
+        self.state = OPEN
+        self.opened_at = time.monotonic()
+
+    def record_failure(self):
+        self.failures += 1
+        self.stats['failed'] += 1
+        if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+            self.open()
+
+    def record_success(self):
+        recovered = self.failures > 0 or self.state != CLOSED
+        self.state = CLOSED
+        self.failures = 0
+
+        if recovered:
+            logger.info('%s calls succeed again, reconciling', self.name)
+            for callback in self.recover_callbacks:
+                task = asyncio.create_task(self._run_callback(callback))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+
+    def on_recover(self, callback):
+        """Register an async callback reconciling the state missed during a failure"""
+
+        self.recover_callbacks.append(callback)
+        return callback
+
+    async def _run_callback(self, callback):
+        try:
+            await callback()
+        except Exception:
+            logger.exception('%s reconciliation failed, it is retried on the next recovery', self.name)
+
+
+redis_breaker = CircuitBreaker('redis', REDIS_BREAKER_FAILURES, REDIS_BREAKER_RESET,
+                               errors=(RedisError, OSError, asyncio.TimeoutError))
+
+metrics.register(metrics.Gauge('redis_breaker_state', 'Redis circuit state: 0 closed, 1 half-open, 2 open',
+                               lambda: STATE_VALUES[redis_breaker.state]))
+metrics.register(metrics.Gauge('redis_breaker_opened_total', 'Times the redis circuit opened',
+                               lambda: redis_breaker.stats['opened'], 'counter'))
+metrics.register(metrics.Gauge('redis_breaker_failed_total', 'Redis calls failed under the breaker',
+                               lambda: redis_breaker.stats['failed'], 'counter'))
+metrics.register(metrics.Gauge('redis_breaker_rejected_total', 'Redis calls rejected by the open circuit',
+                               lambda: redis_breaker.stats['rejected'], 'counter'))
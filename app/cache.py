@@ -0,0 +1,303 @@
+import time
+from collections import OrderedDict
+from datetime import datetime
+from uuid import UUID
+
+import orjson
+from sqlalchemy import select, cast, Integer
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app import metrics
+from app.breaker import redis_breaker, BreakerError
+from app.db.models import User, Post
+from app.redis_conn import redis
+from environ import (USER_CACHE_SIZE, USER_CACHE_TTL, USER_CACHE_REDIS_TTL,
+                     POST_CACHE_TTL, POST_CACHE_LOCAL_SIZE, POST_CACHE_LOCAL_TTL,
+                     POSTS_PAGE_CACHE_TTL, REPLICA_STICKY_SECONDS)
+
+
+class LRUCache:
+    """Bounded in-process LRU cache with a TTL for every entry"""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+
+    def get(self, key):
+        item = self._data.get(key)
+        if item is None:
+            return None
+
+        value, expires_at = item
+        if expires_at < time.monotonic():
+            self._data.pop(key, None)
+            return None
+
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key, value):
+        self._data[key] = (value, time.monotonic() + self.ttl)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def delete(self, key):
+        self._data.pop(key, None)
+
+    def clear(self):
+        self._data.clear()
+
+
+# Workers publish the keys of changed entries here (user:{uuid}, post:{id}),
+# app.invalidation evicts them from the local caches of every worker
+INVALIDATION_CHANNEL = 'cache:invalidate'
+
+user_cache = LRUCache(USER_CACHE_SIZE, USER_CACHE_TTL)
+
+
+async def get_user(uuid, db: AsyncSession) -> User | None:
+    """Return the user by uuid looking up the local cache, then redis,
+    then the db. The returned object is not bound to any session"""
+
+    key = str(uuid)
+
+    user = user_cache.get(key)
+    if user is not None:
+        return user
+
+    try:
+        fields = await redis_breaker.call(redis.hgetall, f'user:{key}')
+    except BreakerError:
+        # redis is unavailable, the db is the only tier left
+        fields = None
+
+    if fields:
+        user = User(uuid=UUID(fields[b'uuid'].decode()),
+                    email=fields[b'email'].decode(),
+                    created_at=datetime.fromisoformat(fields[b'created_at'].decode()))
+    else:
+        result = await db.execute(select(User).filter(User.uuid == key))
+        db_user = result.scalar()
+        if db_user is None:
+            return None
+
+        user = User(uuid=db_user.uuid, email=db_user.email, created_at=db_user.created_at)
+        if fields is not None:
+            await set_user(user)
+
+    user_cache.set(key, user)
+    return user
+
+
+async def set_user(user: User):
+    """Put the user into redis, skipped while redis is unavailable"""
+
+    async def write():
+        async with redis.pipeline(transaction=True) as pipe:
+            pipe.hset(f'user:{user.uuid}', mapping={'uuid': str(user.uuid),
+                                                    'email': user.email,
+                                                    'created_at': user.created_at.isoformat()})
+            pipe.expire(f'user:{user.uuid}', USER_CACHE_REDIS_TTL)
+            await pipe.execute()
+
+    try:
+        await redis_breaker.call(write)
+    except BreakerError:
+        pass
+
+
+async def invalidate_user(uuid):
+    """Drop the user from both cache tiers and tell other workers to drop it"""
+
+    key = str(uuid)
+    user_cache.delete(key)
+    await invalidate_keys([f'user:{key}'])
+
+
+post_cache = LRUCache(POST_CACHE_LOCAL_SIZE, POST_CACHE_LOCAL_TTL)
+
+post_cache_stats = {
+    'local_hits': 0,
+    'redis_hits': 0,
+    'misses': 0,
+}
+
+for name in post_cache_stats:
+    metrics.register(metrics.Gauge(f'post_cache_{name}_total', f'Post cache {name.replace("_", " ")}',
+                                   lambda name=name: post_cache_stats[name], 'counter'))
+
+
+def post_to_dict(post: Post) -> dict:
+    """Fields of the post that are cached, rating is never cached
+    since it is kept in its own counter"""
+
+    return {
+        'id': post.id,
+        'title': post.title,
+        'content': post.content,
+        'published': post.published,
+        'author_id': post.author_id,
+        'created_at': post.created_at,
+    }
+
+
+# KEYS[1] - post:{id}, KEYS[2] - its write marker, ARGV[1] - the post, ARGV[2] - ttl.
+# A post written after it was read from the db is marked, so the stale read is dropped
+REFILL_POST_LUA = """
+if redis.call('EXISTS', KEYS[2]) == 0 then
+    redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[2])
+end
+"""
+
+refill_post_script = redis.register_script(REFILL_POST_LUA)
+
+
+async def get_post(post_id: int, db: AsyncSession, read_db: AsyncSession | None = None) -> dict | None:
+    """Return the post by id (published or not) looking up the local cache,
+    then redis, then the db. On a miss read_db (a replica session) is used
+    unless the post has just been written or redis is unavailable"""
+
+    if POST_CACHE_LOCAL_SIZE:
+        post = post_cache.get(post_id)
+        if post is not None:
+            post_cache_stats['local_hits'] += 1
+            return post
+
+    try:
+        cached, written = await redis_breaker.call(redis.mget, f'post:{post_id}', f'post:{post_id}:written')
+    except BreakerError:
+        # the write marker is unknown, so the primary is read and redis is not refilled
+        cached, written = None, True
+
+    if cached is not None:
+        post_cache_stats['redis_hits'] += 1
+        post = orjson.loads(cached)
+    else:
+        post_cache_stats['misses'] += 1
+        session = read_db if read_db is not None and written is None else db
+        result = await session.execute(select(Post).filter(Post.id == cast(post_id, Integer)))
+        db_post = result.scalar()
+        if db_post is None:
+            return None
+
+        post = post_to_dict(db_post)
+        if written is not None:
+            # the post has just been written, a refill could race with the
+            # invalidation and put back the version read before the write
+            return post
+        try:
+            await redis_breaker.call(refill_post_script, keys=[f'post:{post_id}', f'post:{post_id}:written'],
+                                     args=[orjson.dumps(post), POST_CACHE_TTL])
+        except BreakerError:
+            pass
+
+    if POST_CACHE_LOCAL_SIZE:
+        post_cache.set(post_id, post)
+    return post
+
+
+async def invalidate_post(post_id: int):
+    """Drop the post from both cache tiers and tell other workers to drop it.
+    The post is marked as written for a while, so a lagging replica doesn't
+    put the old version back"""
+
+    post_cache.delete(post_id)
+    await invalidate_keys([f'post:{post_id}'], mark_written=True)
+
+
+# keys of the entries (and the posts generation) that could not be invalidated
+# in redis while it was unavailable, invalidated once it recovers
+pending_invalidations: set[str] = set()
+
+
+async def invalidate_keys(keys: list[str], mark_written: bool = False):
+    """Delete the entries from redis and publish their keys to other workers.
+    While redis is unavailable the keys are left pending"""
+
+    async def write():
+        async with redis.pipeline(transaction=False) as pipe:
+            for key in keys:
+                pipe.delete(key)
+                if mark_written:
+                    pipe.set(f'{key}:written', 1, ex=REPLICA_STICKY_SECONDS)
+                pipe.publish(INVALIDATION_CHANNEL, key)
+            await pipe.execute()
+
+    try:
+        await redis_breaker.call(write)
+    except BreakerError:
+        pending_invalidations.update(keys)
+
+
+# Listing pages are cached under the current posts generation. Any change of
+# the set of published posts bumps the generation and so drops all the pages
+POSTS_GENERATION_KEY = 'posts:generation'
+
+
+async def get_posts_page(page_key: str) -> tuple[int | None, dict | None, bool]:
+    """Return current posts generation, the cached listing page for it and
+    whether the generation has been bumped recently (so a replica may lag).
+    While redis is unavailable there is no generation and no page"""
+
+    async def read():
+        async with redis.client() as red:
+            generation, bumped = await red.mget(POSTS_GENERATION_KEY, f'{POSTS_GENERATION_KEY}:bumped')
+            generation = int(generation or 0)
+            cached = await red.get(f'posts:page:{generation}:{page_key}')
+        return generation, cached, bumped
+
+    try:
+        generation, cached, bumped = await redis_breaker.call(read)
+    except BreakerError:
+        # pending invalidations may be missed, so pages are read from the primary
+        return None, None, True
+
+    return generation, orjson.loads(cached) if cached is not None else None, bumped is not None
+
+
+async def set_posts_page(generation: int | None, page_key: str, page: dict):
+    """Cache the listing page built for the posts generation"""
+
+    if generation is None:
+        return
+
+    try:
+        await redis_breaker.call(redis.set, f'posts:page:{generation}:{page_key}', orjson.dumps(page),
+                                 ex=POSTS_PAGE_CACHE_TTL)
+    except BreakerError:
+        pass
+
+
+async def bump_posts_generation():
+    """Invalidate all cached listing pages"""
+
+    async def write():
+        async with redis.pipeline(transaction=True) as pipe:
+            pipe.incr(POSTS_GENERATION_KEY)
+            pipe.set(f'{POSTS_GENERATION_KEY}:bumped', 1, ex=REPLICA_STICKY_SECONDS)
+            await pipe.execute()
+
+    try:
+        await redis_breaker.call(write)
+    except BreakerError:
+        pending_invalidations.add(POSTS_GENERATION_KEY)
+
+
+@redis_breaker.on_recover
+async def reconcile_invalidations():
+    """Apply the invalidations missed while redis was unavailable,
+    the ones failing again are left pending"""
+
+    if not pending_invalidations:
+        return
+
+    keys = list(pending_invalidations)
+    pending_invalidations.difference_update(keys)
+
+    entries = [key for key in keys if key != POSTS_GENERATION_KEY]
+    if entries:
+        await invalidate_keys(entries)
+    if POSTS_GENERATION_KEY in keys:
+        await bump_posts_generation()
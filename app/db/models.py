@@ -1,13 +1,16 @@
 import uuid
 from datetime import datetime
 
-from sqlalchemy import Column, String, Integer, Boolean, TIMESTAMP, ForeignKey
-from sqlalchemy.orm import declarative_base
-from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy import Column, String, Integer, BigInteger, Boolean, TIMESTAMP, ForeignKey, Index, Computed, text
+from sqlalchemy.orm import declarative_base, deferred
+from sqlalchemy.dialects.postgresql import UUID, TSVECTOR
 
 
 Base = declarative_base()
 
+# text search configuration of the post search vector, queries must use the same one
+SEARCH_CONFIG = 'english'
+
 
 class User(Base):
     __tablename__ = 'user'
@@ -17,6 +20,10 @@ class User(Base):
     password = Column(String, nullable=False)
     created_at = Column(TIMESTAMP, nullable=False, default=datetime.utcnow)
 
+    __table_args__ = (
+        Index('ix_user_created_at_uuid', 'created_at', 'uuid'),
+    )
+
 
 class Post(Base):
     __tablename__ = 'post'
@@ -25,8 +32,28 @@ class Post(Base):
     title = Column(String, nullable=False)
     content = Column(String, nullable=False)
     published = Column(Boolean, default=True, nullable=False)
-    created_at = Column(TIMESTAMP, default=datetime.utcnow)
+    created_at = Column(TIMESTAMP, nullable=False, default=datetime.utcnow)
     author_id = Column(UUID, ForeignKey("user.uuid", ondelete="CASCADE"))
+    # maintained by a trigger on the vote table in the same transaction as the vote
+    likes_count = Column(Integer, nullable=False, default=0, server_default='0')
+    dislikes_count = Column(Integer, nullable=False, default=0, server_default='0')
+    # maintained by postgres, deferred so that regular selects don't carry it
+    search_vector = deferred(Column(TSVECTOR, Computed(
+        f"setweight(to_tsvector('{SEARCH_CONFIG}', title), 'A') || "
+        f"setweight(to_tsvector('{SEARCH_CONFIG}', content), 'B')", persisted=True)))
+
+    __table_args__ = (
+        Index('ix_post_created_at_id', 'created_at', 'id',
+              postgresql_where=text('published')),
+        Index('ix_post_author_id_created_at_id', 'author_id', 'created_at', 'id'),
+        Index('ix_post_search_vector', 'search_vector', postgresql_using='gin',
+              postgresql_where=text('published')),
+    )
+
+
+# published posts by rating, for sorting by rating in sql
+Index('ix_post_rating', (Post.likes_count - Post.dislikes_count).desc(), Post.id.desc(),
+      postgresql_where=text('published'))
 
 
 class Vote(Base):
@@ -35,8 +62,10 @@ class Vote(Base):
     user_uuid = Column(UUID, ForeignKey("user.uuid", ondelete="CASCADE"),
                        primary_key=True, nullable=False)
     post_id = Column(Integer, ForeignKey("post.id", ondelete="CASCADE"),
-                     primary_key=True, nullable=False)
+                     primary_key=True, nullable=False, index=True)
     is_like = Column(Boolean, nullable=False)
+    # order of the vote, a write-behind flush never overwrites a later vote
+    seq = Column(BigInteger, nullable=False, server_default='0')
 
 
 
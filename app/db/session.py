@@ -1,17 +1,146 @@
+import asyncio
+import time
 from typing import AsyncGenerator
 
-from sqlalchemy.ext.asyncio import (AsyncSession, async_sessionmaker,
+from fastapi import Depends, Request
+from sqlalchemy import event, text
+from sqlalchemy.ext.asyncio import (AsyncEngine, AsyncSession, async_sessionmaker,
                                     create_async_engine)
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 
-from config import DATABASE_URL
+from app import metrics
+from config import DATABASE_URL, REPLICA_DATABASE_URL
+from environ import (REPLICA_STICKY_SECONDS, DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT,
+                     DB_POOL_RECYCLE, DB_POOL_PRE_PING, DB_POOL_WARM)
 
 
-engine = create_async_engine(DATABASE_URL)
+class TimedQueuePool(AsyncAdaptedQueuePool):
+    """Queue pool observing how long checkouts wait for a connection"""
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            metrics.db_pool_wait.observe(time.perf_counter() - started)
+
+
+def make_engine(url: str, application_name: str) -> AsyncEngine:
+    """Engine with the configured pool. No connection is opened until the
+    first checkout (or warm_up_pools)"""
+
+    # application_name makes the routing visible in pg_stat_activity, even when
+    # the replica is the same instance under another url
+    return create_async_engine(url, poolclass=TimedQueuePool,
+                               pool_size=DB_POOL_SIZE,
+                               max_overflow=DB_MAX_OVERFLOW,
+                               pool_timeout=DB_POOL_TIMEOUT,
+                               pool_recycle=DB_POOL_RECYCLE,
+                               pool_pre_ping=DB_POOL_PRE_PING,
+                               connect_args={'server_settings': {'application_name': application_name}})
+
+
+engine = make_engine(DATABASE_URL, 'primary')
 async_session_maker = async_sessionmaker(engine, expire_on_commit=False)
 
+read_engine = make_engine(REPLICA_DATABASE_URL, 'replica') if REPLICA_DATABASE_URL else engine
+async_read_session_maker = async_sessionmaker(read_engine, expire_on_commit=False)
+
+
+async def warm_up_pools(connections: int = DB_POOL_WARM):
+    """Open the connections (up to the pool size) of both engines at once,
+    so the first requests don't pay for the connection setup"""
+
+    async def open_connection(db_engine: AsyncEngine):
+        async with db_engine.connect() as conn:
+            await conn.execute(text('SELECT 1'))
+
+    for db_engine in {engine, read_engine}:
+        await asyncio.gather(*(open_connection(db_engine)
+                               for _ in range(min(connections, DB_POOL_SIZE))))
+
+
+async def ping() -> None:
+    """Round-trip to the primary, raises if it is unavailable"""
+
+    async with engine.connect() as conn:
+        await conn.execute(text('SELECT 1'))
+
+
+async def dispose_engines():
+    """Close all pooled connections of both engines"""
+
+    for db_engine in {engine, read_engine}:
+        await db_engine.dispose()
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['query_started'].pop()
+    metrics.sql_latency.observe(elapsed, statement.lstrip().split(None, 1)[0].upper())
+
+
+for sync_engine in {engine.sync_engine, read_engine.sync_engine}:
+    event.listen(sync_engine, 'before_cursor_execute', before_cursor_execute)
+    event.listen(sync_engine, 'after_cursor_execute', after_cursor_execute)
+
+
+metrics.register(metrics.Gauge('db_pool_checked_out', 'Connections checked out of the db pool',
+                               lambda: engine.pool.checkedout()))
+metrics.register(metrics.Gauge('db_pool_overflow', 'Connections opened above the db pool size',
+                               lambda: max(engine.pool.overflow(), 0)))
+metrics.register(metrics.Gauge('db_pool_size', 'Configured size of the db pool',
+                               lambda: engine.pool.size()))
+
+
+if read_engine is not engine:
+    metrics.register(metrics.Gauge('db_replica_pool_checked_out', 'Connections checked out of the replica pool',
+                                   lambda: read_engine.pool.checkedout()))
+
+
+# set on responses to writes, while it lives the client reads from the primary
+PRIMARY_COOKIE = 'db_primary'
+WRITE_METHODS = {'POST', 'PUT', 'PATCH', 'DELETE'}
+
 
 async def get_async_session() -> AsyncGenerator[AsyncSession, None]:
     async with async_session_maker() as session:
         yield session
 
 
+async def get_read_session(request: Request,
+                           session: AsyncSession = Depends(get_async_session)) -> AsyncGenerator[AsyncSession, None]:
+    """Session for pure reads. Goes to the replica (if configured) unless the
+    client has written recently, so it always sees its own writes. Otherwise
+    it is the very same session as the primary one of the request"""
+
+    if read_engine is engine or request.cookies.get(PRIMARY_COOKIE):
+        yield session
+        return
+
+    async with async_read_session_maker() as read_session:
+        yield read_session
+
+
+class StickyPrimaryMiddleware:
+    """ASGI middleware marking clients that have just written, so their reads
+    stick to the primary for REPLICA_STICKY_SECONDS (the expected replication lag)"""
+
+    def __init__(self, app):
+        self.app = app
+        self.cookie = (f'{PRIMARY_COOKIE}=1; Max-Age={REPLICA_STICKY_SECONDS}; '
+                       f'Path=/; HttpOnly; SameSite=lax').encode()
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or scope['method'] not in WRITE_METHODS:
+            return await self.app(scope, receive, send)
+
+        async def send_wrapper(message):
+            if message['type'] == 'http.response.start' and message['status'] < 400:
+                message['headers'] = [*message.get('headers', []), (b'set-cookie', self.cookie)]
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
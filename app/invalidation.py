@@ -0,0 +1,80 @@
+import asyncio
+import logging
+
+from app import cache, metrics
+from app.redis_conn import blocking_redis
+from environ import USER_CACHE_TTL, POST_CACHE_LOCAL_TTL, CACHE_FALLBACK_TTL
+
+
+logger = logging.getLogger(__name__)
+
+
+# seconds between reconnection attempts of the subscriber
+RECONNECT_DELAY = 1.0
+
+# In-process caches kept coherent by the bus with their normal TTLs
+LOCAL_CACHES = (
+    (cache.user_cache, USER_CACHE_TTL),
+    (cache.post_cache, POST_CACHE_LOCAL_TTL),
+)
+
+stats = {
+    'connected': 0,
+    'received': 0,
+    'disconnects': 0,
+}
+
+metrics.register(metrics.Gauge('cache_invalidation_connected', 'Whether the invalidation subscriber is connected',
+                               lambda: stats['connected']))
+metrics.register(metrics.Gauge('cache_invalidations_received_total', 'Invalidation messages received',
+                               lambda: stats['received'], 'counter'))
+metrics.register(metrics.Gauge('cache_invalidation_disconnects_total', 'Invalidation subscriber disconnects',
+                               lambda: stats['disconnects'], 'counter'))
+
+
+def set_connected(connected: bool):
+    """Switch the local caches between the normal TTLs and the fallback one.
+    Entries cached so far are dropped either way, since they may have missed
+    invalidations sent while the subscriber was down"""
+
+    stats['connected'] = int(connected)
+    for lru, ttl in LOCAL_CACHES:
+        lru.clear()
+        lru.ttl = ttl if connected else min(ttl, CACHE_FALLBACK_TTL)
+
+
+def evict(message: bytes):
+    """Drop the local entry named by the message (user:{uuid} or post:{id})"""
+
+    kind, _, key = message.decode().partition(':')
+    if kind == 'user':
+        cache.user_cache.delete(key)
+    elif kind == 'post':
+        cache.post_cache.delete(int(key))
+
+
+async def run(stop: asyncio.Event):
+    """Evict local cache entries changed by any worker until stop is set,
+    reconnecting with the fallback TTL in effect while disconnected"""
+
+    set_connected(False)
+    while not stop.is_set():
+        pubsub = blocking_redis.pubsub(ignore_subscribe_messages=True)
+        try:
+            await pubsub.subscribe(cache.INVALIDATION_CHANNEL)
+            set_connected(True)
+
+            while not stop.is_set():
+                message = await pubsub.get_message(timeout=1.0)
+                if message is not None:
+                    stats['received'] += 1
+                    evict(message['data'])
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            set_connected(False)
+            stats['disconnects'] += 1
+            logger.exception('Cache invalidation subscriber disconnected, reconnecting')
+            await asyncio.sleep(RECONNECT_DELAY)
+        finally:
+            await pubsub.close()
@@ -0,0 +1,112 @@
+"""Top and trending posts kept in redis sorted sets.
+
+Top is scored by the rating. Trending uses a time-decayed "hot" score:
+sign(rating) * log10(max(|rating|, 1)) + (created_at - EPOCH) / TRENDING_DECAY,
+so every TRENDING_DECAY seconds of post age cost a 10x rating. Both sets are
+updated by the vote script together with the cached rating of the post.
+
+    python -m app.leaderboard    # rebuild both sets from the post vote counters
+"""
+import asyncio
+import math
+import time
+from datetime import datetime
+
+from sqlalchemy import select, cast, Boolean
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.db.models import Post
+from app.db.session import async_session_maker, engine
+from app.redis_conn import redis
+from environ import TRENDING_DECAY
+
+
+TOP_KEY = 'posts:top'
+TRENDING_KEY = 'posts:trending'
+EPOCH = datetime(2023, 1, 1)
+REBUILD_CHUNK = 5000
+
+
+def age_term(created_at: datetime | str) -> float:
+    """Time part of the trending score"""
+
+    if isinstance(created_at, str):
+        created_at = datetime.fromisoformat(created_at)
+    return (created_at - EPOCH).total_seconds() / TRENDING_DECAY
+
+
+def hot_score(rating: int, created_at: datetime | str) -> float:
+    """Trending score of a post, the same formula as in the vote script"""
+
+    sign = (rating > 0) - (rating < 0)
+    return sign * math.log10(max(abs(rating), 1)) + age_term(created_at)
+
+
+async def update_post(post_id: int, rating: int, created_at: datetime | str):
+    """Put the post into both sets, e.g. when it is created or published"""
+
+    async with redis.pipeline(transaction=True) as pipe:
+        pipe.zadd(TOP_KEY, {post_id: rating})
+        pipe.zadd(TRENDING_KEY, {post_id: hot_score(rating, created_at)})
+        await pipe.execute()
+
+
+async def remove_post(post_id: int):
+    """Drop the post from both sets, e.g. when it is deleted or unpublished"""
+
+    async with redis.pipeline(transaction=True) as pipe:
+        pipe.zrem(TOP_KEY, post_id)
+        pipe.zrem(TRENDING_KEY, post_id)
+        await pipe.execute()
+
+
+async def get_post_ids(key: str, limit: int) -> list[int]:
+    """Ids of the highest scored posts of the set, O(log N + k)"""
+
+    return [int(post_id) for post_id in await redis.zrevrange(key, 0, limit - 1)]
+
+
+async def rebuild(db: AsyncSession) -> int:
+    """Recompute both sets from the vote counters of the posts. The new sets are
+    built under temporary keys and swapped in atomically. Return the number of posts"""
+
+    stmt = select(Post.id, Post.created_at, Post.likes_count - Post.dislikes_count).filter(
+        Post.published == cast(True, Boolean))
+
+    top_tmp, trending_tmp = f'{TOP_KEY}:rebuild', f'{TRENDING_KEY}:rebuild'
+    await redis.delete(top_tmp, trending_tmp)
+
+    total = trending_total = 0
+    result = await db.stream(stmt.execution_options(yield_per=REBUILD_CHUNK))
+    async for rows in result.partitions():
+        trending = {post_id: hot_score(rating, created_at)
+                    for post_id, created_at, rating in rows if created_at}
+        async with redis.pipeline(transaction=False) as pipe:
+            pipe.zadd(top_tmp, {post_id: rating for post_id, _, rating in rows})
+            if trending:
+                pipe.zadd(trending_tmp, trending)
+            await pipe.execute()
+        total += len(rows)
+        trending_total += len(trending)
+
+    async with redis.pipeline(transaction=True) as pipe:
+        pipe.delete(TOP_KEY, TRENDING_KEY)
+        if total:
+            pipe.rename(top_tmp, TOP_KEY)
+        if trending_total:
+            pipe.rename(trending_tmp, TRENDING_KEY)
+        await pipe.execute()
+
+    return total
+
+
+async def main():
+    started = time.perf_counter()
+    async with async_session_maker() as session:
+        total = await rebuild(session)
+    await engine.dispose()
+    print(f'Rebuilt leaderboards of {total} posts in {time.perf_counter() - started:.2f}s')
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -1,16 +1,99 @@
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
+from fastapi.responses import ORJSONResponse
+
+
+logger = logging.getLogger(__name__)
+
+
+async def warm_up_redis():
+    from app import redis_conn
+
+    try:
+        await redis_conn.warm_up()
+    except Exception:
+        logger.exception('Redis warm-up failed, starting without it')
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    from app import vote_writer, warmup, invalidation, redis_conn
+    from app.db import session
+    from environ import VOTE_WRITE_BEHIND, VOTE_CACHE_WARMUP, CACHE_INVALIDATION
+
+    stop = asyncio.Event()
+    tasks = []
+
+    # connections are opened before the app reports ready. Redis is optional,
+    # the app degrades to postgres through the breaker, so its warm-up may fail
+    await asyncio.gather(session.warm_up_pools(), warm_up_redis())
+
+    if VOTE_CACHE_WARMUP:
+        try:
+            # a live cache is never overwritten by a rolling deploy
+            await warmup.warmup(only_cold=True)
+        except Exception:
+            logger.exception('Vote cache warmup failed, it is filled on cache misses instead')
+
+    if VOTE_WRITE_BEHIND:
+        tasks.append(asyncio.create_task(vote_writer.run(stop)))
+
+    if CACHE_INVALIDATION:
+        tasks.append(asyncio.create_task(invalidation.run(stop)))
+
+    app.state.ready = True
+
+    yield
+
+    # drain: stop reporting ready, let background consumers finish
+    # their batches, then close the pools
+    app.state.ready = False
+    stop.set()
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        await session.dispose_engines()
+        await redis_conn.close()
+
 
-from app.routers.auth import router as auth_router
-from app.routers.users import router as users_router
-from app.routers.posts import router as posts_router
+def create_app() -> FastAPI:
+    """Build the application. Routers (and so the engines and the redis client
+    they use) are imported here, which keeps the import of this module cheap"""
 
+    from app.db.session import StickyPrimaryMiddleware, read_engine, engine
+    from app.metrics import MetricsMiddleware
+    from app.routers.auth import router as auth_router
+    from app.routers.users import router as users_router
+    from app.routers.posts import router as posts_router
+    from app.routers.stats import router as stats_router
+    from app.routers.metrics import router as metrics_router
+    from app.routers.health import router as health_router
 
-app = FastAPI(title='Simple social network')
+    app = FastAPI(title='Simple social network', lifespan=lifespan,
+                  default_response_class=ORJSONResponse)
+    app.state.ready = False
 
+    app.add_middleware(MetricsMiddleware)
+    if read_engine is not engine:
+        app.add_middleware(StickyPrimaryMiddleware)
 
-app.include_router(auth_router)
-app.include_router(users_router)
-app.include_router(posts_router)
+    app.include_router(auth_router)
+    app.include_router(users_router)
+    app.include_router(posts_router)
+    app.include_router(stats_router)
+    app.include_router(metrics_router)
+    app.include_router(health_router)
 
+    return app
 
 
+def __getattr__(name):
+    # `uvicorn app.main:app` builds the app on first access,
+    # `uvicorn --factory app.main:create_app` does the same explicitly
+    if name == 'app':
+        globals()['app'] = create_app()
+        return globals()['app']
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
@@ -0,0 +1,118 @@
+import time
+from bisect import bisect_left
+
+
+# Collectors are only touched from the event loop thread (SQLAlchemy events run
+# in the greenlet of the awaiting coroutine), so the hot path needs no locks
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def format_labels(label_names: tuple, label_values: tuple) -> str:
+    pairs = ','.join(f'{name}="{value}"' for name, value in zip(label_names, label_values))
+    return f'{{{pairs}}}' if pairs else ''
+
+
+class Histogram:
+    """Prometheus-like histogram with fixed buckets"""
+
+    def __init__(self, name: str, documentation: str, label_names: tuple = (),
+                 buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = label_names
+        self.buckets = buckets
+        # label values -> [count per bucket (+Inf last), sum]
+        self._series = {}
+
+    def observe(self, value: float, *label_values):
+        series = self._series.get(label_values)
+        if series is None:
+            series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def render(self) -> list[str]:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        for label_values, (counts, total) in list(self._series.items()):
+            cumulative = 0
+            for bound, count in zip((*self.buckets, '+Inf'), counts):
+                cumulative += count
+                labels = format_labels((*self.label_names, 'le'), (*label_values, bound))
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            labels = format_labels(self.label_names, label_values)
+            lines.append(f'{self.name}_sum{labels} {total}')
+            lines.append(f'{self.name}_count{labels} {cumulative}')
+        return lines
+
+
+class Gauge:
+    """Gauge whose value is read from a callback at scrape time"""
+
+    def __init__(self, name: str, documentation: str, callback, metric_type: str = 'gauge'):
+        self.name = name
+        self.documentation = documentation
+        self.callback = callback
+        self.metric_type = metric_type
+
+    def render(self) -> list[str]:
+        return [f'# HELP {self.name} {self.documentation}',
+                f'# TYPE {self.name} {self.metric_type}',
+                f'{self.name} {self.callback()}']
+
+
+registry = []
+
+
+def register(collector):
+    registry.append(collector)
+    return collector
+
+
+def render() -> str:
+    """All registered collectors in Prometheus text format"""
+
+    lines = []
+    for collector in registry:
+        lines.extend(collector.render())
+    return '\n'.join(lines) + '\n'
+
+
+http_latency = register(Histogram('http_request_duration_seconds',
+                                  'HTTP request latency by route',
+                                  ('method', 'route', 'status')))
+sql_latency = register(Histogram('sql_statement_duration_seconds',
+                                 'SQL statement execution time by statement type',
+                                 ('statement',)))
+redis_latency = register(Histogram('redis_command_duration_seconds',
+                                   'Redis command round-trip time by command',
+                                   ('command',)))
+db_pool_wait = register(Histogram('db_pool_wait_seconds',
+                                  'Time spent waiting for a connection from the db pool'))
+
+
+class MetricsMiddleware:
+    """ASGI middleware observing latency of every HTTP request by route template"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message['type'] == 'http.response.start':
+                status_code = message['status']
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get('route')
+            http_latency.observe(time.perf_counter() - started, scope['method'],
+                                 route.path if route is not None else 'unmatched', status_code)
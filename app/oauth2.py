@@ -2,13 +2,13 @@ from fastapi import Depends, status, HTTPException
 from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
 from datetime import datetime, timedelta
+from uuid import UUID
 
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
 
 import environ
-from app import schemas
-from app.db import models, session
+from app import schemas, cache
+from app.db import session
 
 
 oauth_scheme = OAuth2PasswordBearer(tokenUrl='login')
@@ -48,16 +48,24 @@ def verify_access_token(token: str, credential_exception):
     return token_data
 
 
-async def get_current_user(token: str = Depends(oauth_scheme),
-                           db: AsyncSession = Depends(session.get_async_session)):
-    """Verify JWT token and get current user from it"""
+def get_current_user_uuid(token: str = Depends(oauth_scheme)) -> UUID:
+    """Verify JWT token and get uuid of the current user from it without db lookup"""
 
     credentials_exception = HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
                                           detail=f'Could not validate credentials',
                                           headers={"WWW-Authenticate": "Bearer"})
     token = verify_access_token(token, credentials_exception)
 
-    result = await db.execute(select(models.User).filter(models.User.uuid == token.uuid))
-    user = result.scalar()
+    try:
+        return UUID(token.uuid)
+    except ValueError:
+        raise credentials_exception
+
+
+async def get_current_user(user_uuid: UUID = Depends(get_current_user_uuid),
+                           db: AsyncSession = Depends(session.get_async_session)):
+    """Verify JWT token and get current user from it"""
+
+    user = await cache.get_user(user_uuid, db)
 
     return user
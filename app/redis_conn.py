@@ -1,6 +1,64 @@
+import asyncio
+import time
+
 import aioredis
+from aioredis.client import Pipeline
+
+from app import metrics
+from environ import (REDIS_PORT, REDIS_HOST, REDIS_DB, REDIS_MAX_CONNECTIONS,
+                     REDIS_POOL_TIMEOUT, REDIS_SOCKET_TIMEOUT, REDIS_POOL_WARM)
+
+
+class TimedPipeline(Pipeline):
+    """Pipeline observing the round-trip of the whole batch"""
+
+    async def execute(self, raise_on_error: bool = True):
+        started = time.perf_counter()
+        try:
+            return await super().execute(raise_on_error)
+        finally:
+            metrics.redis_latency.observe(time.perf_counter() - started,
+                                          'MULTI' if self.transaction else 'PIPELINE')
+
+
+class TimedRedis(aioredis.Redis):
+    """Redis client observing the round-trip of every command.
+    Clients made by client() are timed as well since they are built from self.__class__"""
+
+    async def execute_command(self, *args, **options):
+        started = time.perf_counter()
+        try:
+            return await super().execute_command(*args, **options)
+        finally:
+            metrics.redis_latency.observe(time.perf_counter() - started, str(args[0]).upper())
+
+    def pipeline(self, transaction: bool = True, shard_hint=None):
+        return TimedPipeline(self.connection_pool, self.response_callbacks, transaction, shard_hint)
+
+
+# Blocking pool: when all connections are busy callers wait up to REDIS_POOL_TIMEOUT
+# for a free one instead of failing. Nothing is connected until first use (or warm_up)
+redis = TimedRedis(connection_pool=aioredis.BlockingConnectionPool.from_url(
+    f"redis://{REDIS_HOST}:{REDIS_PORT}/{REDIS_DB}",
+    max_connections=REDIS_MAX_CONNECTIONS,
+    timeout=REDIS_POOL_TIMEOUT,
+    socket_timeout=REDIS_SOCKET_TIMEOUT,
+    socket_connect_timeout=REDIS_SOCKET_TIMEOUT))
+
+# Long blocking reads (the votes stream consumer, pub/sub) can't live with the
+# tight read timeout of the main client, so they get their own connections
+blocking_redis = TimedRedis.from_url(f"redis://{REDIS_HOST}:{REDIS_PORT}/{REDIS_DB}",
+                                     socket_connect_timeout=REDIS_SOCKET_TIMEOUT)
+
+
+async def warm_up(connections: int = REDIS_POOL_WARM):
+    """Open the connections at once, so the first requests don't pay for them"""
+
+    await asyncio.gather(*(redis.ping() for _ in range(min(connections, REDIS_MAX_CONNECTIONS))))
 
-from environ import REDIS_PORT, REDIS_HOST, REDIS_DB
 
+async def close():
+    """Close all pooled connections"""
 
-redis = aioredis.from_url(f"redis://{REDIS_HOST}:{REDIS_PORT}/{REDIS_DB}")
+    await redis.connection_pool.disconnect()
+    await blocking_redis.connection_pool.disconnect()
@@ -1,36 +1,43 @@
+from datetime import datetime
+from typing import AsyncGenerator
+from uuid import UUID
+
+import orjson
 from fastapi import Depends, HTTPException
-from sqlalchemy import select, cast, Integer, Boolean, update, delete
+from sqlalchemy import select, cast, Integer, Boolean, update, delete, tuple_, literal, func
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.ext.asyncio import AsyncSession
 from starlette import status
 
-from app import utils, schemas
-from app.db.models import Post
-from app.db.session import get_async_session
+from app import utils, schemas, cache, vote_writer
+from app.db.models import Post, Vote, SEARCH_CONFIG
+from app.db.session import get_async_session, get_read_session
 from app.repositories.base import BaseDBRepository
-from environ import PER_PAGE
+from environ import PER_PAGE, EXPORT_CHUNK_SIZE
 
 
 class PostRepository(BaseDBRepository):
     model = Post
 
-    def __init__(self, session: AsyncSession = Depends(get_async_session)):
+    def __init__(self, session: AsyncSession = Depends(get_async_session),
+                 read_session: AsyncSession = Depends(get_read_session)):
         self.session = session
+        # pure reads only, may be a lagging replica
+        self.read_session = read_session
 
     async def get(self, id: int):
         utils.check_int_value(id)
 
-        stmt = select(self.model).filter(self.model.id == cast(id, Integer),
-                                         self.model.published == cast(True, Boolean))
-        result = await self.session.execute(stmt)
-        post = result.scalar()
+        post = await cache.get_post(id, self.session, self.read_session)
 
-        if not post:
+        if not post or not post['published']:
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
                                 detail=f'Post with id: {id} not found')
 
         rating = await utils.get_post_rating(id, self.session)
 
-        post_response = utils.post_to_response(post, rating)
+        # validated once by the response_model of the route
+        post_response = {**post, 'rating': rating}
 
         return post_response
 
@@ -39,76 +46,319 @@ class PostRepository(BaseDBRepository):
         self.session.add(new_post)
         await self.session.commit()
         await self.session.refresh(new_post)
+        if new_post.published:
+            await cache.bump_posts_generation()
+            await utils.update_leaderboards(new_post.id, 0, new_post.created_at, True)
         post_response = utils.post_to_response(new_post, 0)
 
         return post_response
 
-    async def get_all_paginated(self, page):
-        utils.check_int_value(page)
-        if page < 1:
-            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
-                                detail="Invalid page number. Page number must "
-                                       "be greater than or equal to 1.")
+    async def get_all_paginated(self, page: int | None = None, cursor: str | None = None):
+        """Return a page of published posts (as dicts ready for serialization) and
+        the cursor of the next page. Keyset pagination by (created_at, id), `page` is a deprecated fallback"""
 
         stmt = select(self.model).filter(
-            self.model.published == cast(True, Boolean)).offset((page - 1) * PER_PAGE).limit(PER_PAGE)
+            self.model.published == cast(True, Boolean)).order_by(
+            self.model.created_at, self.model.id).limit(PER_PAGE + 1)
 
-        result = await self.session.execute(stmt)
-        posts = result.scalars()
-        posts_response = []
-        for post in posts:
-            rating = await utils.get_post_rating(post.id, self.session)
-            posts_response.append(utils.post_to_response(post, rating))
+        if cursor is not None:
+            created_at, post_id = utils.decode_cursor(cursor, int)
+            stmt = stmt.filter(tuple_(self.model.created_at, self.model.id) >
+                               tuple_(created_at, post_id))
+            page_key = f'cursor:{cursor}'
+        elif page is not None:
+            utils.check_int_value(page)
+            if page < 1:
+                raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                                    detail="Invalid page number. Page number must "
+                                           "be greater than or equal to 1.")
+            stmt = stmt.offset((page - 1) * PER_PAGE)
+            page_key = f'page:{page}'
+        else:
+            page_key = 'first'
 
-        return posts_response
+        generation, cached_page, bumped = await cache.get_posts_page(page_key)
 
-    async def update(self, post_id, post, user_uuid):
-        utils.check_int_value(post_id)
+        if cached_page is not None:
+            posts, next_cursor = cached_page['posts'], cached_page['next_cursor']
+        else:
+            # right after a write the replica may miss it, and the page would be cached stale
+            session = self.session if bumped else self.read_session
+            result = await session.execute(stmt)
+            db_posts = result.scalars().all()
+
+            next_cursor = None
+            if len(db_posts) > PER_PAGE:
+                db_posts = db_posts[:PER_PAGE]
+                next_cursor = utils.encode_cursor(db_posts[-1].created_at, db_posts[-1].id)
+
+            posts = [cache.post_to_dict(post) for post in db_posts]
+            await cache.set_posts_page(generation, page_key,
+                                       {'posts': posts, 'next_cursor': next_cursor})
+
+        # ratings are never cached with the page, so votes don't invalidate it
+        ratings = await utils.get_posts_ratings([post['id'] for post in posts], self.session)
+        # plain dicts, serialized straight to JSON by the route
+        posts_response = [{**post, 'rating': ratings[post['id']]} for post in posts]
+
+        return posts_response, next_cursor
+
+    @classmethod
+    def author_feed_query(cls, author_id: UUID, cursor: str | None = None):
+        """Published posts of the author ordered by (created_at, id),
+        served by the (author_id, created_at, id) index"""
+
+        stmt = select(cls.model).filter(
+            cls.model.author_id == author_id,
+            cls.model.published == cast(True, Boolean)).order_by(
+            cls.model.created_at, cls.model.id).limit(PER_PAGE + 1)
+
+        if cursor is not None:
+            created_at, post_id = utils.decode_cursor(cursor, int)
+            stmt = stmt.filter(tuple_(cls.model.created_at, cls.model.id) >
+                               tuple_(created_at, post_id))
+        return stmt
+
+    async def get_by_author(self, author_id: UUID, cursor: str | None = None):
+        """Return a page of published posts of the author (as dicts ready for
+        serialization) and the cursor of the next page"""
+
+        result = await self.read_session.execute(self.author_feed_query(author_id, cursor))
+        posts = result.scalars().all()
+
+        next_cursor = None
+        if len(posts) > PER_PAGE:
+            posts = posts[:PER_PAGE]
+            next_cursor = utils.encode_cursor(posts[-1].created_at, posts[-1].id)
+
+        ratings = await utils.get_posts_ratings([post.id for post in posts], self.session)
+        posts_response = [{**cache.post_to_dict(post), 'rating': ratings[post.id]} for post in posts]
+
+        return posts_response, next_cursor
+
+    @classmethod
+    def search_query(cls, q: str, cursor: str | None = None):
+        """Published posts matching the web search style query ordered by rank
+        (title matches weigh more) and id, matches are found by the GIN index"""
+
+        query = func.websearch_to_tsquery(SEARCH_CONFIG, q)
+        rank = func.ts_rank_cd(cls.model.search_vector, query)
+
+        stmt = select(cls.model, rank).filter(
+            cls.model.published == cast(True, Boolean),
+            cls.model.search_vector.op('@@')(query)).order_by(
+            rank.desc(), cls.model.id.desc()).limit(PER_PAGE + 1)
+
+        if cursor is not None:
+            last_rank, post_id = utils.decode_rank_cursor(cursor)
+            stmt = stmt.filter(tuple_(rank, cls.model.id) < tuple_(last_rank, post_id))
+        return stmt
+
+    async def search(self, q: str, cursor: str | None = None):
+        """Return a page of published posts matching the query (as dicts ready
+        for serialization), best matches first, and the cursor of the next page"""
+
+        rows = (await self.read_session.execute(self.search_query(q, cursor))).all()
+
+        next_cursor = None
+        if len(rows) > PER_PAGE:
+            rows = rows[:PER_PAGE]
+            next_cursor = utils.encode_rank_cursor(rows[-1][1], rows[-1][0].id)
+
+        ratings = await utils.get_posts_ratings([post.id for post, _ in rows], self.session)
+        posts_response = [{**cache.post_to_dict(post), 'rating': ratings[post.id]} for post, _ in rows]
+
+        return posts_response, next_cursor
+
+    async def get_by_ids(self, post_ids: list[int]) -> list[dict]:
+        """Return published posts with the ids (as dicts ready for serialization)
+        keeping the order of the ids. Missing and unpublished posts are skipped"""
+
+        if not post_ids:
+            return []
+
+        stmt = select(self.model).filter(self.model.id.in_(post_ids),
+                                         self.model.published == cast(True, Boolean))
+        result = await self.read_session.execute(stmt)
+        posts = {post.id: cache.post_to_dict(post) for post in result.scalars()}
+
+        ratings = await utils.get_posts_ratings(list(posts), self.session)
+
+        return [{**posts[post_id], 'rating': ratings[post_id]}
+                for post_id in post_ids if post_id in posts]
+
+    async def get_top(self, limit: int) -> list[dict]:
+        """Return the highest rated published posts (as dicts ready for serialization)
+        straight from the vote counters, served by the rating index"""
+
+        rating = self.model.likes_count - self.model.dislikes_count
+        stmt = select(self.model).filter(
+            self.model.published == cast(True, Boolean)).order_by(
+            rating.desc(), self.model.id.desc()).limit(limit)
+        result = await self.read_session.execute(stmt)
 
-        stmt = select(self.model).filter(self.model.id == cast(post_id, Integer))
+        return [{**cache.post_to_dict(post), 'rating': post.likes_count - post.dislikes_count}
+                for post in result.scalars()]
 
-        result = await self.session.execute(stmt)
-        post_to_update = result.scalar()
+    async def get_latest(self, limit: int) -> list[dict]:
+        """Return the newest published posts (as dicts ready for serialization)
+        with ratings from the vote counters, served by the created_at index"""
 
-        if post_to_update is None:
+        stmt = select(self.model).filter(
+            self.model.published == cast(True, Boolean)).order_by(
+            self.model.created_at.desc(), self.model.id.desc()).limit(limit)
+        result = await self.read_session.execute(stmt)
+
+        return [{**cache.post_to_dict(post), 'rating': post.likes_count - post.dislikes_count}
+                for post in result.scalars()]
+
+    async def export(self, author_id: UUID | None = None, created_from: datetime | None = None,
+                     created_to: datetime | None = None) -> AsyncGenerator[bytes, None]:
+        """Yield published posts with ratings as NDJSON chunks. Rows are read
+        through a server-side cursor, so memory does not depend on the table size.
+        Ratings come from the vote counters of the posts, the vote table is not read"""
+
+        stmt = select(self.model.id, self.model.title, self.model.content, self.model.published,
+                      self.model.author_id, self.model.created_at,
+                      (self.model.likes_count - self.model.dislikes_count).label('rating')).filter(
+            self.model.published == cast(True, Boolean)).order_by(self.model.id)
+
+        if author_id is not None:
+            stmt = stmt.filter(self.model.author_id == author_id)
+        if created_from is not None:
+            stmt = stmt.filter(self.model.created_at >= created_from)
+        if created_to is not None:
+            stmt = stmt.filter(self.model.created_at < created_to)
+
+        result = await self.read_session.stream(stmt.execution_options(yield_per=EXPORT_CHUNK_SIZE))
+        async for rows in result.mappings().partitions():
+            yield b''.join(orjson.dumps(dict(row)) + b'\n' for row in rows)
+
+    async def check_author(self, post_id: int):
+        """Called when a write filtered by the author matched no rows.
+        Raise 404 if the post does not exist, 403 otherwise"""
+
+        stmt = select(self.model.id).filter(self.model.id == cast(post_id, Integer))
+        if await self.session.scalar(stmt) is None:
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
                                 detail=f'Post with id: {post_id} does not exist')
 
-        if post_to_update.author_id != user_uuid:
-            raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
-                                detail=f'Not authorized to perform requested action')
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
+                            detail=f'Not authorized to perform requested action')
 
-        stmt_to_update = update(self.model).where(
-            self.model.id == cast(post_id, Integer)).values(title=post.title,
-                                                            content=post.content,
-                                                            published=post.published)
+    async def update(self, post_id, post, user_uuid):
+        utils.check_int_value(post_id)
+
+        stmt = update(self.model).where(
+            self.model.id == cast(post_id, Integer),
+            self.model.author_id == user_uuid).values(title=post.title,
+                                                      content=post.content,
+                                                      published=post.published).returning(self.model)
+
+        updated_post = (await self.session.execute(
+            stmt, execution_options={'synchronize_session': False})).scalar()
+
+        if updated_post is None:
+            await self.check_author(post_id)
 
-        await self.session.execute(stmt_to_update)
         await self.session.commit()
+        await cache.invalidate_post(post_id)
+        await cache.bump_posts_generation()
 
-        after_update = await self.session.execute(stmt)
-        updated_post = after_update.scalar()
+        rating = await utils.get_post_rating(updated_post.id, self.session)
+        await utils.update_leaderboards(updated_post.id, int(rating), updated_post.created_at,
+                                        updated_post.published)
 
-        updated_post_res = utils.post_to_response(updated_post,
-                                                  await utils.get_post_rating(updated_post.id, self.session))
+        updated_post_res = utils.post_to_response(updated_post, rating)
 
         return updated_post_res
 
     async def delete(self, post_id, user_uuid):
         utils.check_int_value(post_id)
 
-        stmt = select(self.model).filter(self.model.id == cast(post_id, Integer))
-        result = await self.session.execute(stmt)
-        post = result.scalar()
+        stmt = delete(self.model).where(
+            self.model.id == cast(post_id, Integer),
+            self.model.author_id == user_uuid).returning(self.model.id)
 
-        if post is None:
-            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
-                                detail=f'Post with id: {post_id} does not exist')
+        deleted_id = (await self.session.execute(
+            stmt, execution_options={'synchronize_session': False})).scalar()
 
-        if post.author_id != user_uuid:
-            raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
-                                detail=f'Not authorized to perform requested action')
+        if deleted_id is None:
+            await self.check_author(post_id)
 
-        stmt_to_delete = delete(self.model).filter(self.model.id == cast(post_id, Integer))
-        await self.session.execute(stmt_to_delete)
         await self.session.commit()
+        await cache.invalidate_post(post_id)
+        await cache.bump_posts_generation()
+        await utils.update_leaderboards(post_id, 0, None, False)
+
+    async def vote(self, post_id: int, user_uuid, is_like: bool) -> tuple[bool | None, datetime]:
+        """Insert or update the vote of the user in a single statement.
+        Return the previous vote (None if the user has not voted for the post yet)
+        and created_at of the post"""
+
+        utils.check_int_value(post_id)
+
+        # RETURNING sees the table as it was before the statement, so the
+        # subquery yields the previous vote
+        previous_vote = Vote.__table__.alias('previous_vote')
+        previous = select(previous_vote.c.is_like).where(
+            previous_vote.c.user_uuid == user_uuid,
+            previous_vote.c.post_id == post_id).scalar_subquery()
+
+        # the vote row exists only if the post exists, is published and the user
+        # is not its author. Unpublished posts are not found, as for GET, and so
+        # never get back into the leaderboards through a vote
+        source = select(literal(user_uuid, Vote.user_uuid.type), self.model.id, literal(is_like),
+                        literal(vote_writer.now_seq(), Vote.seq.type)).where(
+            self.model.id == cast(post_id, Integer), self.model.published == cast(True, Boolean),
+            self.model.author_id != user_uuid)
+
+        stmt = insert(Vote).from_select(['user_uuid', 'post_id', 'is_like', 'seq'], source)
+        created_at = select(self.model.created_at).where(
+            self.model.id == cast(post_id, Integer)).scalar_subquery()
+        stmt = stmt.on_conflict_do_update(index_elements=[Vote.user_uuid, Vote.post_id],
+                                          set_={'is_like': stmt.excluded.is_like,
+                                                'seq': stmt.excluded.seq}).returning(previous, created_at)
+
+        row = (await self.session.execute(stmt)).first()
+
+        if row is None:
+            stmt = select(self.model.id).filter(self.model.id == cast(post_id, Integer),
+                                                self.model.published == cast(True, Boolean))
+            if await self.session.scalar(stmt) is None:
+                raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+                                    detail=f"The post with id: {post_id} not found")
+            raise HTTPException(status_code=status.HTTP_409_CONFLICT,
+                                detail=f"You cannot {'dis' if not is_like else ''}like your own posts")
+
+        await self.session.commit()
+
+        return row[0], row[1]
+
+    async def vote_many(self, votes: dict[int, bool], user_uuid) -> tuple[dict[int, datetime], set[int]]:
+        """Insert or update votes {post_id: is_like} of the user in one transaction.
+        Return created_at of the voted posts and ids of the posts authored by the
+        user (not voted). Missing and unpublished posts are skipped"""
+
+        # the posts can't be deleted until the votes are committed. Rows are
+        # locked and written in post id order, so concurrent batches don't deadlock
+        stmt = select(self.model.id, self.model.author_id, self.model.created_at).filter(
+            self.model.id.in_(list(votes)), self.model.published == cast(True, Boolean)).order_by(self.model.id).with_for_update(read=True, key_share=True)
+        rows = (await self.session.execute(stmt)).all()
+
+        own = {post_id for post_id, author_id, _ in rows if str(author_id) == str(user_uuid)}
+        voted = {post_id: created_at for post_id, _, created_at in rows if post_id not in own}
+
+        if voted:
+            seq = vote_writer.now_seq()
+            stmt = insert(Vote).values([{'user_uuid': user_uuid, 'post_id': post_id,
+                                         'is_like': votes[post_id], 'seq': seq}
+                                        for post_id in sorted(voted)])
+            stmt = stmt.on_conflict_do_update(index_elements=[Vote.user_uuid, Vote.post_id],
+                                              set_={'is_like': stmt.excluded.is_like,
+                                                    'seq': stmt.excluded.seq})
+            await self.session.execute(stmt)
+
+        await self.session.commit()
+
+        return voted, own
@@ -5,23 +5,28 @@ from fastapi import HTTPException, status, Depends
 
 from app import schemas
 from app.repositories.base import BaseDBRepository
-from sqlalchemy import select, cast, String
+from sqlalchemy import select, cast, String, tuple_
 from app.db.models import User
-from app.db.session import get_async_session
-from app import utils
+from app.db.session import get_async_session, get_read_session
+from app import utils, cache
 from environ import PER_PAGE
 
 
 class UserRepository(BaseDBRepository):
     model = User
 
-    def __init__(self, session: AsyncSession = Depends(get_async_session)):
+    def __init__(self, session: AsyncSession = Depends(get_async_session),
+                 read_session: AsyncSession = Depends(get_read_session)):
         self.session = session
+        # pure reads only, may be a lagging replica
+        self.read_session = read_session
 
     async def get(self, id: UUID):
-        stmt = select(self.model).filter(self.model.uuid == id)
-        result = await self.session.execute(stmt)
-        user = result.scalar()
+        user = await cache.get_user(id, self.read_session)
+
+        if not user and self.read_session is not self.session:
+            # the user may be too new for the replica
+            user = await cache.get_user(id, self.session)
 
         if not user:
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
@@ -37,7 +42,7 @@ class UserRepository(BaseDBRepository):
             raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
                                 detail=f'The user with {user.email} is already registered')
 
-        hashed_password = utils.hash_password(user.password)
+        hashed_password = await utils.hash_password(user.password)
         user.password = hashed_password
 
         new_user_dict = user.model_dump()
@@ -47,14 +52,40 @@ class UserRepository(BaseDBRepository):
         self.session.add(new_user)
         await self.session.commit()
         await self.session.refresh(new_user)
+        await cache.invalidate_user(new_user.uuid)
         return new_user
 
-    async def get_all_paginated(self, page):
-        stmt = select(self.model).offset((page - 1) * PER_PAGE).limit(PER_PAGE)
-        result = await self.session.execute(stmt)
-        users = result.scalars()
-
-        return users
+    async def get_all_paginated(self, page: int | None = None, cursor: str | None = None):
+        """Return a page of users (as dicts ready for serialization) and the cursor
+        of the next page. Keyset pagination by (created_at, uuid), `page` is a deprecated fallback"""
+
+        stmt = select(self.model).order_by(
+            self.model.created_at, self.model.uuid).limit(PER_PAGE + 1)
+
+        if cursor is not None:
+            created_at, uuid = utils.decode_cursor(cursor, UUID)
+            stmt = stmt.filter(tuple_(self.model.created_at, self.model.uuid) >
+                               tuple_(created_at, uuid))
+        elif page is not None:
+            utils.check_int_value(page)
+            if page < 1:
+                raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                                    detail="Invalid page number. Page number must "
+                                           "be greater than or equal to 1.")
+            stmt = stmt.offset((page - 1) * PER_PAGE)
+
+        result = await self.read_session.execute(stmt)
+        users = result.scalars().all()
+
+        next_cursor = None
+        if len(users) > PER_PAGE:
+            users = users[:PER_PAGE]
+            next_cursor = utils.encode_cursor(users[-1].created_at, users[-1].uuid)
+
+        users_response = [{'uuid': user.uuid, 'email': user.email, 'created_at': user.created_at}
+                          for user in users]
+
+        return users_response, next_cursor
 
     async def update(self, id):
         raise NotImplementedError('Delete is not implemented')
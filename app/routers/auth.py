@@ -1,11 +1,11 @@
 from fastapi import APIRouter, Depends, status, HTTPException, Response
 from fastapi.security.oauth2 import OAuth2PasswordRequestForm, OAuth2PasswordBearer
-from sqlalchemy import select, cast, String
+from sqlalchemy import select, cast, String, update
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app import schemas, utils, oauth2
 from app.db import models
-from app.db.session import get_async_session
+from app.db.session import get_async_session, get_read_session
 
 
 router = APIRouter(tags=['Authentication'])
@@ -13,21 +13,32 @@ router = APIRouter(tags=['Authentication'])
 
 @router.post('/login', response_model=schemas.Token, description='Login for registered users')
 async def login(user_credentials: OAuth2PasswordRequestForm = Depends(),
-                db: AsyncSession = Depends(get_async_session)):
+                db: AsyncSession = Depends(get_async_session),
+                read_db: AsyncSession = Depends(get_read_session)):
 
     #Since OAuth2PasswordRequestForm uses username and password we compare email with username
-    result = await db.execute(select(models.User).filter(
-        models.User.email == cast(user_credentials.username, String)))
-    user = result.scalar()
+    stmt = select(models.User).filter(models.User.email == cast(user_credentials.username, String))
+    user = (await read_db.execute(stmt)).scalar()
+
+    if not user and read_db is not db:
+        # the user may be too new for the replica
+        user = (await db.execute(stmt)).scalar()
 
     if not user:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
                             detail='Invalid credentials')
 
-    if not utils.verify_password(user_credentials.password, user.password):
+    valid, new_hash = await utils.verify_and_update_password(user_credentials.password,
+                                                             user.password)
+    if not valid:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
                             detail='Invalid credentials')
 
+    if new_hash:
+        await db.execute(update(models.User).where(
+            models.User.uuid == user.uuid).values(password=new_hash))
+        await db.commit()
+
     # create a token
     access_token = oauth2.create_access_token(data={'uuid': str(user.uuid)})
     return {"access_token": access_token, 'token_type': "bearer"}
@@ -0,0 +1,44 @@
+import asyncio
+
+from fastapi import APIRouter, HTTPException, Request, status
+
+from app import redis_conn
+from app.breaker import redis_breaker
+from app.db import session
+
+
+router = APIRouter(
+    prefix='/health',
+    tags=['Health']
+)
+
+# seconds a dependency has to answer the readiness probe
+PROBE_TIMEOUT = 1.0
+
+
+@router.get('/live', description='The process is up')
+async def live():
+    return {'status': 'ok'}
+
+
+@router.get('/ready', description='The pools are warmed up and postgres answers. 503 while starting, '
+                                  'draining or when postgres is down. Redis is reported but not required, '
+                                  'the app serves from postgres without it')
+async def ready(request: Request):
+    if not request.app.state.ready:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                            detail='Not ready')
+
+    try:
+        await asyncio.wait_for(session.ping(), PROBE_TIMEOUT)
+    except Exception:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                            detail='postgres is unavailable')
+
+    try:
+        await asyncio.wait_for(redis_conn.redis.ping(), PROBE_TIMEOUT)
+        redis_status = 'ok'
+    except Exception:
+        redis_status = 'unavailable'
+
+    return {'status': 'ready', 'redis': redis_status, 'redis_breaker': redis_breaker.state}
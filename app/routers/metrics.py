@@ -0,0 +1,13 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+
+from app import metrics
+
+
+router = APIRouter(tags=['Metrics'])
+
+
+@router.get('/metrics', description='Metrics in Prometheus text format',
+            response_class=PlainTextResponse)
+async def get_metrics():
+    return metrics.render()
@@ -1,11 +1,14 @@
-from fastapi import status, HTTPException, Depends, APIRouter, Response
-from sqlalchemy import select, cast, Integer, update, Boolean, delete
-from sqlalchemy.ext.asyncio import AsyncSession
+from datetime import datetime
+from uuid import UUID
 
-from app import schemas, oauth2, utils
-from app.db.models import User, Vote, Post
-from app.db.session import get_async_session
+from fastapi import status, HTTPException, Depends, APIRouter, Response, Query
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from pydantic import conlist
+
+from app import schemas, oauth2, utils, cache, leaderboard
+from app.breaker import redis_breaker, BreakerError, CLOSED
 from app.repositories.posts import PostRepository
+from environ import VOTE_WRITE_BEHIND, BATCH_MAX_SIZE
 
 router = APIRouter(
     prefix='/posts',
@@ -18,11 +21,82 @@ router = APIRouter(
              response_model=schemas.PostResponse)
 async def create_post(post: schemas.PostCreate,
                       post_repo: PostRepository = Depends(),
-                      current_user: User = Depends(oauth2.get_current_user)):
-    new_post = await post_repo.post(post, current_user.uuid)
+                      user_uuid: UUID = Depends(oauth2.get_current_user_uuid)):
+    new_post = await post_repo.post(post, user_uuid)
     return new_post
 
 
+@router.get("/top",
+            description='Get the highest rated posts',
+            response_model=list[schemas.PostResponse])
+async def get_top_posts(limit: int = Query(10, ge=1, le=100),
+                        post_repo: PostRepository = Depends()):
+    try:
+        post_ids = await redis_breaker.call(leaderboard.get_post_ids, leaderboard.TOP_KEY, limit)
+    except BreakerError:
+        # redis is unavailable, the rating index gives the same order
+        return ORJSONResponse(await post_repo.get_top(limit))
+
+    posts = await post_repo.get_by_ids(post_ids)
+
+    return ORJSONResponse(posts)
+
+
+@router.get("/trending",
+            description='Get trending posts: rating decayed by the age of the post',
+            response_model=list[schemas.PostResponse])
+async def get_trending_posts(limit: int = Query(10, ge=1, le=100),
+                             post_repo: PostRepository = Depends()):
+    try:
+        post_ids = await redis_breaker.call(leaderboard.get_post_ids, leaderboard.TRENDING_KEY, limit)
+    except BreakerError:
+        # redis is unavailable, the newest posts stand in for the trending ones
+        return ORJSONResponse(await post_repo.get_latest(limit))
+
+    posts = await post_repo.get_by_ids(post_ids)
+
+    return ORJSONResponse(posts)
+
+
+@router.get("/search",
+            description='Full-text search over titles and contents of published posts, best matches first. '
+                        'Supports quoted phrases, OR and -excluded words. Cursor of the next page '
+                        'is returned in the X-Next-Cursor header',
+            response_model=list[schemas.PostResponse])
+async def search_posts(q: str = Query(..., min_length=1, max_length=200),
+                       cursor: str | None = None,
+                       post_repo: PostRepository = Depends()):
+    posts, next_cursor = await post_repo.search(q, cursor)
+
+    headers = {'X-Next-Cursor': next_cursor} if next_cursor else None
+
+    return ORJSONResponse(posts, headers=headers)
+
+
+@router.get("/export",
+            description='Export published posts with ratings as NDJSON (one post per line). '
+                        'Optional filters by author and [created_from, created_to) range',
+            response_class=StreamingResponse)
+async def export_posts(author_id: UUID | None = None,
+                       created_from: datetime | None = None,
+                       created_to: datetime | None = None,
+                       post_repo: PostRepository = Depends()):
+    return StreamingResponse(post_repo.export(author_id, created_from, created_to),
+                             media_type='application/x-ndjson')
+
+
+@router.get("/batch",
+            description='Get published posts by ids (repeated or comma-separated `ids`) in the order of the ids. '
+                        'Missing and unpublished posts are skipped',
+            response_model=list[schemas.PostResponse])
+async def get_posts_batch(ids: list[str] = Query(...),
+                          post_repo: PostRepository = Depends()):
+    post_ids = utils.parse_post_ids(ids, BATCH_MAX_SIZE)
+    posts = await post_repo.get_by_ids(post_ids)
+
+    return ORJSONResponse(posts)
+
+
 @router.get("/{post_id}",
             description='Get post with provided id',
             response_model=schemas.PostResponse)
@@ -33,13 +107,19 @@ async def get_post(post_id: int, post_repo: PostRepository = Depends()):
 
 
 @router.get("",
-            description='Get paginated list of posts',
+            description='Get paginated list of posts. Cursor of the next page '
+                        'is returned in the X-Next-Cursor header',
             response_model=list[schemas.PostResponse])
-async def get_all_published_posts(page: int = 1,
+async def get_all_published_posts(cursor: str | None = None,
+                                  page: int | None = Query(None, deprecated=True),
                                   post_repo: PostRepository = Depends()):
-    posts = await post_repo.get_all_paginated(page)
+    posts, next_cursor = await post_repo.get_all_paginated(page, cursor)
 
-    return posts
+    # response_model is only used for docs, the rows are already in shape,
+    # so they skip the validation and go straight to orjson
+    headers = {'X-Next-Cursor': next_cursor} if next_cursor else None
+
+    return ORJSONResponse(posts, headers=headers)
 
 
 @router.put("/{post_id}",
@@ -48,8 +128,8 @@ async def get_all_published_posts(page: int = 1,
 async def update_post(post_id: int,
                       post: schemas.PostUpdate,
                       post_repo: PostRepository = Depends(),
-                      current_user: User = Depends(oauth2.get_current_user)):
-    updated_post = await post_repo.update(post_id, post, current_user.uuid)
+                      user_uuid: UUID = Depends(oauth2.get_current_user_uuid)):
+    updated_post = await post_repo.update(post_id, post, user_uuid)
     return updated_post
 
 
@@ -57,8 +137,8 @@ async def update_post(post_id: int,
                description='Delete a post. Only for author of the post.')
 async def delete_post(post_id: int,
                       post_repo: PostRepository = Depends(),
-                      current_user: User = Depends(oauth2.get_current_user)):
-    await post_repo.delete(post_id, current_user.uuid)
+                      user_uuid: UUID = Depends(oauth2.get_current_user_uuid)):
+    await post_repo.delete(post_id, user_uuid)
 
     return Response(status_code=status.HTTP_204_NO_CONTENT)
 
@@ -68,26 +148,65 @@ async def delete_post(post_id: int,
                          'is like, otherwise - dislike')
 async def like_post(post_id: int,
                     is_like: bool,
-                    db: AsyncSession = Depends(get_async_session),
-                    current_user: User = Depends(oauth2.get_current_user)):
+                    post_repo: PostRepository = Depends(),
+                    user_uuid: UUID = Depends(oauth2.get_current_user_uuid)):
 
     utils.check_int_value(post_id)
-
-    post_stmt = select(Post).filter(Post.id == post_id)
-    post = (await db.execute(post_stmt)).scalar()
-
-    if not post:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
-                            detail=f"The post with id: {post_id} not found")
-    if post.author_id == current_user.uuid:
-        raise HTTPException(status_code=status.HTTP_409_CONFLICT,
-                            detail=f"You cannot {'dis' if not is_like else ''}like your own posts")
-
-    await utils.change_redis_on_vote(post_id, current_user.uuid, is_like, db)
-
-    vote = Vote(user_uuid=current_user.uuid, post_id=post_id, is_like=is_like)
-
-    await db.merge(vote)
-    await db.commit()
-
-    return {'success': f'You have {"dis" if not is_like else ""}liked post with id: {post_id}'}
+    result = {'success': f'You have {"dis" if not is_like else ""}liked post with id: {post_id}'}
+
+    if VOTE_WRITE_BEHIND and redis_breaker.state == CLOSED:
+        # the author check is served by the post cache, postgres is written later
+        post = await cache.get_post(post_id, post_repo.session)
+
+        if not post or not post['published']:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+                                detail=f"The post with id: {post_id} not found")
+        if str(post['author_id']) == str(user_uuid):
+            raise HTTPException(status_code=status.HTTP_409_CONFLICT,
+                                detail=f"You cannot {'dis' if not is_like else ''}like your own posts")
+
+        try:
+            await utils.apply_vote(post_id, user_uuid, is_like, post_repo.session, post['created_at'],
+                                   enqueue=True)
+            return result
+        except BreakerError:
+            # redis is unavailable, the vote goes straight to postgres
+            pass
+
+    _, created_at = await post_repo.vote(post_id, user_uuid, is_like)
+    await utils.change_redis_on_vote(post_id, user_uuid, is_like, post_repo.session,
+                                     created_at)
+
+    return result
+
+
+@router.post('/votes',
+             description='Like/dislike several posts at once, in one transaction. A later vote for '
+                         'the same post supersedes an earlier one. Every vote gets its own result',
+             response_model=list[schemas.VoteResult])
+async def vote_posts(votes: conlist(schemas.VoteCreate, min_length=1, max_length=BATCH_MAX_SIZE),
+                     post_repo: PostRepository = Depends(),
+                     user_uuid: UUID = Depends(oauth2.get_current_user_uuid)):
+    final = {vote.post_id: vote.is_like for vote in votes}
+    last = {vote.post_id: i for i, vote in enumerate(votes)}
+
+    voted, own = await post_repo.vote_many(final, user_uuid)
+    ratings = await utils.change_redis_on_votes(
+        user_uuid, [(post_id, final[post_id], created_at) for post_id, created_at in voted.items()],
+        post_repo.session)
+
+    results = []
+    for i, vote in enumerate(votes):
+        result = {'post_id': vote.post_id, 'is_like': vote.is_like, 'rating': None}
+        if last[vote.post_id] != i:
+            result['status'] = 'superseded'
+        elif vote.post_id in voted:
+            result['status'] = 'ok'
+            result['rating'] = ratings.get(vote.post_id)
+        elif vote.post_id in own:
+            result['status'] = 'own_post'
+        else:
+            result['status'] = 'not_found'
+        results.append(result)
+
+    return ORJSONResponse(results)
@@ -0,0 +1,14 @@
+from fastapi import APIRouter
+
+from app import cache
+
+
+router = APIRouter(
+    prefix='/stats',
+    tags=['Stats']
+)
+
+
+@router.get('/cache', description='Hit/miss counters of the post cache')
+async def get_cache_stats():
+    return {'post': cache.post_cache_stats}
@@ -1,12 +1,14 @@
 from uuid import UUID
 
-from fastapi import status, HTTPException, Depends, APIRouter
+from fastapi import status, HTTPException, Depends, APIRouter, Query
+from fastapi.responses import ORJSONResponse
 from sqlalchemy import select, cast, String
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.db import models, session
 from app import schemas, utils
 from app.repositories.user import UserRepository
+from app.repositories.posts import PostRepository
 
 
 router = APIRouter(
@@ -24,11 +26,19 @@ async def create_user(user: schemas.UserCreate, user_repo: UserRepository = Depe
 
 
 @router.get('', status_code=status.HTTP_200_OK,
-            description='Get users list',
+            description='Get users list. Cursor of the next page '
+                        'is returned in the X-Next-Cursor header',
             response_model=list[schemas.UserResponse])
-async def get_all_users(page: int = 1, user_repo: UserRepository = Depends()):
-    users_list = await user_repo.get_all_paginated(page)
-    return users_list
+async def get_all_users(cursor: str | None = None,
+                        page: int | None = Query(None, deprecated=True),
+                        user_repo: UserRepository = Depends()):
+    users_list, next_cursor = await user_repo.get_all_paginated(page, cursor)
+
+    # response_model is only used for docs, the rows are already in shape,
+    # so they skip the validation and go straight to orjson
+    headers = {'X-Next-Cursor': next_cursor} if next_cursor else None
+
+    return ORJSONResponse(users_list, headers=headers)
 
 
 
@@ -39,10 +49,19 @@ async def get_user_by_uuid(uuid: UUID, user_repo: UserRepository = Depends()):
     return user
 
 
+@router.get('/{uuid}/posts', description='Get paginated list of published posts of the user. '
+                                         'Cursor of the next page is returned in the X-Next-Cursor header',
+            response_model=list[schemas.PostResponse])
+async def get_user_posts(uuid: UUID,
+                         cursor: str | None = None,
+                         post_repo: PostRepository = Depends(),
+                         user_repo: UserRepository = Depends()):
+    posts, next_cursor = await post_repo.get_by_author(uuid, cursor)
 
+    if not posts and cursor is None:
+        # 404 for unknown users, checked only when there is nothing to show
+        await user_repo.get(uuid)
 
+    headers = {'X-Next-Cursor': next_cursor} if next_cursor else None
 
-
-
-
-
+    return ORJSONResponse(posts, headers=headers)
@@ -3,7 +3,7 @@ from uuid import UUID
 from datetime import datetime
 from typing import Optional
 
-from pydantic import BaseModel, EmailStr, ConfigDict, constr
+from pydantic import BaseModel, EmailStr, ConfigDict, Field, constr
 
 
 class TokenData(BaseModel):
@@ -50,3 +50,15 @@ class PostResponse(PostBase):
 
     model_config = ConfigDict(from_attributes=True)
 
+
+class VoteCreate(BaseModel):
+    post_id: int = Field(ge=1, le=2147483647)
+    is_like: bool
+
+
+class VoteResult(BaseModel):
+    post_id: int
+    is_like: bool
+    # ok, not_found, own_post or superseded (by a later vote for the same post in the batch)
+    status: str
+    rating: Optional[int] = None
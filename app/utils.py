@@ -1,26 +1,66 @@
+import asyncio
+import base64
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
 from fastapi import HTTPException, status
 from passlib.context import CryptContext
-from sqlalchemy import select
+from sqlalchemy import select, func, case
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from app import leaderboard, vote_cache, vote_writer
+from app.breaker import redis_breaker, BreakerError
 from app.db.models import Vote, Post
+from app.db.session import async_session_maker
 from app.redis_conn import redis
 from app.schemas import PostResponse
+from environ import (BCRYPT_ROUNDS, PASSWORD_HASH_WORKERS, PASSWORD_HASH_QUEUE,
+                     RATING_LOCK_TTL, RATING_LOCK_POLL, RATING_CACHE_TTL)
+
+
+# hashes with a cost other than BCRYPT_ROUNDS are rehashed on login
+pwd_context = CryptContext(schemes=['bcrypt'], deprecated="auto",
+                           bcrypt__default_rounds=BCRYPT_ROUNDS,
+                           bcrypt__min_rounds=BCRYPT_ROUNDS,
+                           bcrypt__max_rounds=BCRYPT_ROUNDS)
+
+# bcrypt blocks for tens of milliseconds, so it runs off the event loop
+password_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS,
+                                       thread_name_prefix='password')
+password_jobs = 0
+
+
+async def run_password_job(func, *args):
+    """Run a password hashing function on the password executor.
+    Reject the request right away if the executor queue is full"""
+
+    global password_jobs
 
+    if password_jobs >= PASSWORD_HASH_WORKERS + PASSWORD_HASH_QUEUE:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                            detail='Server is busy, try again later',
+                            headers={'Retry-After': '1'})
 
-pwd_context = CryptContext(schemes=['bcrypt'], deprecated="auto")
+    password_jobs += 1
+    try:
+        return await asyncio.get_running_loop().run_in_executor(password_executor, func, *args)
+    finally:
+        password_jobs -= 1
 
 
-def hash_password(password: str) -> str:
+async def hash_password(password: str) -> str:
     """Hash password to store it in db"""
 
-    return pwd_context.hash(password)
+    return await run_password_job(pwd_context.hash, password)
 
 
-def verify_password(plain_pass: str, hashed_pass: str) -> bool:
-    """Check if the password provided is correct"""
+async def verify_and_update_password(plain_pass: str, hashed_pass: str) -> tuple[bool, str | None]:
+    """Check if the password provided is correct. Also return a new hash
+    if the stored one should be replaced (e.g. bcrypt cost has changed)"""
 
-    return pwd_context.verify(plain_pass, hashed_pass)
+    return await run_password_job(pwd_context.verify_and_update, plain_pass, hashed_pass)
 
 
 def check_int_value(value: int):
@@ -31,16 +71,233 @@ def check_int_value(value: int):
                             detail=f"The value {value} is too large")
 
 
+def parse_post_ids(values: list[str], limit: int) -> list[int]:
+    """Unique post ids from repeated and/or comma-separated query values, in order"""
+
+    try:
+        post_ids = [int(part) for value in values for part in value.split(',') if part]
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail='Post ids must be integers')
+
+    post_ids = list(dict.fromkeys(post_id for post_id in post_ids if 0 < post_id <= 2147483647))
+    if len(post_ids) > limit:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail=f'At most {limit} posts can be requested at once')
+    return post_ids
+
+
+def encode_cursor(created_at: datetime, key) -> str:
+    """Encode keyset position (created_at, key) into an opaque cursor"""
+
+    raw = json.dumps([created_at.isoformat(), str(key)]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str, key_type=str) -> tuple[datetime, object]:
+    """Decode an opaque cursor back into (created_at, key), the key converted
+    with key_type. created_at must be naive, like the timestamps in the db"""
+
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        created_at, key = json.loads(raw)
+        created_at = datetime.fromisoformat(created_at)
+        key = key_type(key)
+        if created_at.tzinfo is not None:
+            raise ValueError('created_at is not naive')
+        if key_type is int and not -2147483648 <= key <= 2147483647:
+            raise ValueError('key is out of the integer range')
+        return created_at, key
+    except (ValueError, TypeError, AttributeError):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail='Invalid cursor')
+
+
+def encode_rank_cursor(rank: float, post_id: int) -> str:
+    """Encode keyset position (rank, id) of search results into an opaque cursor"""
+
+    raw = json.dumps([rank, post_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_rank_cursor(cursor: str) -> tuple[float, int]:
+    """Decode an opaque search cursor back into (rank, id)"""
+
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        rank, post_id = json.loads(raw)
+        return float(rank), int(post_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail='Invalid cursor')
+
+
 async def get_post_rating(post_id: int, db: AsyncSession) -> int:
     """Return post rating of a post from redis"""
 
-    async with redis.client() as red:
-        vote_result = await red.get(f'vote:{post_id}:result')
+    return (await get_posts_ratings([post_id], db))[post_id]
 
-    if vote_result:
-        return vote_result
-    else:
-        return await sync_redis(post_id, db)
+
+async def get_posts_ratings(post_ids: list[int], db: AsyncSession) -> dict[int, int]:
+    """Return ratings of several posts with a single redis round-trip.
+    Posts missing in redis (and all of them while redis is unavailable)
+    are read from the vote counters of the post table"""
+
+    if not post_ids:
+        return {}
+
+    try:
+        return await get_cached_ratings(post_ids, db)
+    except BreakerError:
+        return await get_db_ratings(post_ids, db)
+
+
+def counters_query(post_ids: list[int]):
+    """Vote counters of the posts, a primary key lookup per post"""
+
+    return select(Post.id, Post.likes_count, Post.dislikes_count).where(Post.id.in_(post_ids))
+
+
+async def get_db_ratings(post_ids: list[int], db: AsyncSession) -> dict[int, int]:
+    """Ratings of the posts from their vote counters, redis is not touched"""
+
+    ratings = dict.fromkeys(post_ids, 0)
+    ratings.update({post_id: likes - dislikes
+                    for post_id, likes, dislikes in await db.execute(counters_query(post_ids))})
+    return ratings
+
+
+# rating of a post whose votes are not in redis, cached from the vote counters.
+# The vote scripts never read it, so it doesn't mark the votes as synced
+COUNTER_RATING_KEY = 'rating:{}'
+
+
+async def read_counter_ratings(post_ids: list[int]) -> list[bytes | None]:
+    return await redis.mget([COUNTER_RATING_KEY.format(post_id) for post_id in post_ids])
+
+
+async def get_cached_ratings(post_ids: list[int], db: AsyncSession) -> dict[int, int]:
+    """Ratings of the posts from redis: synced ratings first, then the ones
+    cached from the vote counters. Missing ones are read from the db"""
+
+    ratings = {}
+    missing = list(dict.fromkeys(post_ids))
+    for read in (vote_cache.layout.read_ratings, read_counter_ratings):
+        cached = await redis_breaker.call(read, missing)
+        ratings.update({post_id: int(value) for post_id, value in zip(missing, cached)
+                        if value is not None})
+        missing = [post_id for post_id in missing if post_id not in ratings]
+        if not missing:
+            return ratings
+
+    ratings.update(await fill_missing_ratings(missing, db))
+    return ratings
+
+
+# post id -> future of the rating being loaded by this process
+rating_flights: dict[int, asyncio.Future] = {}
+
+
+async def fill_missing_ratings(post_ids: list[int], db: AsyncSession) -> dict[int, int]:
+    """Load ratings missing in redis, coalescing concurrent misses: a post
+    already being loaded by this process is awaited instead of loaded again"""
+
+    waiting = {post_id: rating_flights[post_id] for post_id in post_ids if post_id in rating_flights}
+    own = [post_id for post_id in post_ids if post_id not in waiting]
+
+    ratings = {}
+    if own:
+        loop = asyncio.get_running_loop()
+        futures = {post_id: loop.create_future() for post_id in own}
+        rating_flights.update(futures)
+        try:
+            ratings.update(await run_locked(own, db, 'rating:{}:lock', load_ratings, read_counter_ratings))
+            for post_id, future in futures.items():
+                future.set_result(ratings[post_id])
+        except BaseException as e:
+            for future in futures.values():
+                if not future.done():
+                    future.set_exception(e)
+                    # retrieved here, so a flight nobody waited for isn't logged as unhandled
+                    future.exception()
+            raise
+        finally:
+            for post_id in own:
+                rating_flights.pop(post_id, None)
+
+    for post_id, future in waiting.items():
+        # shielded, so a cancelled waiter doesn't cancel the flight for the others
+        ratings[post_id] = await asyncio.shield(future)
+
+    return ratings
+
+
+async def load_ratings(post_ids: list[int], db: AsyncSession) -> dict[int, int]:
+    """Ratings of posts missing in redis from the vote counters, a single row
+    read per post instead of a scan of its votes. They are cached for
+    RATING_CACHE_TTL in one pipeline, nonexistent posts too"""
+
+    ratings = await get_db_ratings(post_ids, db)
+
+    async def write():
+        async with redis.pipeline(transaction=False) as pipe:
+            for post_id, rating in ratings.items():
+                pipe.set(COUNTER_RATING_KEY.format(post_id), rating, ex=RATING_CACHE_TTL)
+            await pipe.execute()
+
+    await redis_breaker.call(write)
+    return ratings
+
+
+async def run_locked(post_ids: list[int], db: AsyncSession, lock_key: str, load, read_cached) -> dict[int, int]:
+    """Load ratings of posts with load(post_ids, db) taking a short redis lock
+    per post, so only one worker loads a post at a time. Posts locked by other
+    workers are awaited in redis with read_cached(post_ids), and loaded here
+    only if the lock expires first"""
+
+    async def acquire():
+        async with redis.pipeline(transaction=False) as pipe:
+            for post_id in post_ids:
+                pipe.set(lock_key.format(post_id), 1, nx=True, px=RATING_LOCK_TTL)
+            return await pipe.execute()
+
+    acquired = await redis_breaker.call(acquire)
+
+    locked = [post_id for post_id, ok in zip(post_ids, acquired) if ok]
+    others = [post_id for post_id, ok in zip(post_ids, acquired) if not ok]
+
+    ratings = {}
+    if locked:
+        try:
+            # another worker may have loaded a post and released its lock
+            # right before it was taken here
+            cached = await redis_breaker.call(read_cached, locked)
+            ratings.update({post_id: int(value) for post_id, value in zip(locked, cached)
+                            if value is not None})
+            missing = [post_id for post_id in locked if post_id not in ratings]
+            if missing:
+                ratings.update(await load(missing, db))
+        finally:
+            await redis_breaker.call(redis.delete, *(lock_key.format(post_id) for post_id in locked))
+
+    deadline = time.monotonic() + RATING_LOCK_TTL / 1000
+    while others and time.monotonic() < deadline:
+        await asyncio.sleep(RATING_LOCK_POLL)
+        cached = await redis_breaker.call(read_cached, others)
+        ratings.update({post_id: int(value) for post_id, value in zip(others, cached)
+                        if value is not None})
+        others = [post_id for post_id in others if post_id not in ratings]
+
+    if others:
+        ratings.update(await load(others, db))
+
+    return ratings
+
+
+async def sync_redis_locked(post_ids: list[int], db: AsyncSession) -> dict[int, int]:
+    """Sync votes of posts with redis, one worker rebuilding a post at a time"""
+
+    return await run_locked(post_ids, db, 'vote:{}:lock', sync_redis_bulk, vote_cache.layout.read_ratings)
 
 
 def post_to_response(post: Post, rating: int) -> PostResponse:
@@ -61,51 +318,171 @@ def post_to_response(post: Post, rating: int) -> PostResponse:
 async def sync_redis(post_id: int, db: AsyncSession):
     """Sync Votes table w/ post_id with redis and return rating of the post"""
 
-    stmt = select(Vote).where(Vote.post_id == post_id)
-    votes = (await db.execute(stmt)).scalars().all()
+    return (await sync_redis_bulk([post_id], db))[post_id]
+
+
+def votes_aggregate_query(post_ids: list[int]):
+    """Rating and votes of each of the posts, served by the vote post_id index"""
+
+    return select(Vote.post_id,
+                  func.sum(case((Vote.is_like, 1), else_=-1)),
+                  func.array_agg(Vote.user_uuid),
+                  func.array_agg(Vote.is_like)).where(
+        Vote.post_id.in_(post_ids)).group_by(Vote.post_id)
+
+
+async def sync_redis_bulk(post_ids: list[int], db: AsyncSession) -> dict[int, int]:
+    """Sync Votes of several posts with redis using one aggregate query
+    and one pipeline. Return ratings of the posts"""
+
+    rows = (await db.execute(votes_aggregate_query(post_ids))).all()
+
+    ratings = dict.fromkeys(post_ids, 0)
+    votes = {}
+    for post_id, rating, user_uuids, likes in rows:
+        ratings[post_id] = int(rating)
+        votes[post_id] = zip(user_uuids, likes)
+
+    async def write():
+        async with redis.pipeline(transaction=False) as pipe:
+            for post_id, rating in ratings.items():
+                vote_cache.layout.write_post(pipe, post_id, rating, votes.get(post_id, ()))
+                # the synced rating supersedes the one cached from the counters
+                pipe.delete(COUNTER_RATING_KEY.format(post_id))
+            await pipe.execute()
+
+    await redis_breaker.call(write)
+
+    return ratings
+
 
-    if not votes:
-        async with redis.client() as red:
-            await red.set(f'vote:{post_id}:result', 0)
-        return 0
+async def change_redis_on_vote(post_id: int, user_uuid, is_like: bool, db: AsyncSession,
+                               created_at: datetime | str | None = None) -> int:
+    """Apply the vote (already stored in postgres) to redis and return the new
+    rating of the post. While redis is unavailable the rating is read from
+    the db and the post is resynced to redis once it recovers"""
 
-    rating = 0
-    async with redis.client() as red:
-        for vote in votes:
-            rating += (1 if vote.is_like else -1)
-            await red.set(f'vote:{vote.post_id}:{vote.user_uuid}', 1 if vote.is_like else -1)
-        await red.set(f'vote:{post_id}:result', rating)
+    try:
+        return await apply_vote(post_id, user_uuid, is_like, db, created_at)
+    except BreakerError:
+        stale_posts.add(post_id)
+        return (await get_db_ratings([post_id], db))[post_id]
+
+
+async def apply_vote(post_id: int, user_uuid, is_like: bool, db: AsyncSession,
+                     created_at: datetime | str | None = None, enqueue: bool = False) -> int:
+    """Atomically apply the vote to redis and return the new rating of the post.
+    Top and trending sets are updated in the same step, the latter only if
+    created_at of the post is provided. With enqueue the vote is appended to
+    the write-behind stream in the same MULTI, so redis never has a vote
+    that doesn't reach postgres. Redis failures are raised as BreakerError"""
+
+    vote = 1 if is_like else -1
+    age_term = leaderboard.age_term(created_at) if created_at else ''
+
+    async def run():
+        async with redis.pipeline(transaction=True) as pipe:
+            await vote_cache.layout.queue_vote(pipe, post_id, user_uuid, vote, age_term)
+            vote_writer.queue_enqueue(pipe, post_id, user_uuid, is_like)
+            rating, _ = await pipe.execute()
+            return rating
+
+    if enqueue:
+        rating = await redis_breaker.call(run)
+    else:
+        rating = await redis_breaker.call(vote_cache.layout.apply_vote, post_id, user_uuid, vote, age_term)
+
+    if rating is None:
+        # votes of the post are not in redis yet - sync them and try again,
+        # the vote is queued already
+        await sync_redis_locked([post_id], db)
+        rating = await redis_breaker.call(vote_cache.layout.apply_vote, post_id, user_uuid, vote, age_term)
 
     return rating
 
 
-async def change_redis_on_vote(post_id: int, user_uuid, is_like: bool, db: AsyncSession):
-    """Ugly redis interactions on vote"""
-    async with redis.client() as red:
-        if not await red.keys(f'vote:{post_id}:*'):
-            await get_post_rating(post_id, db)
+async def change_redis_on_votes(user_uuid, votes: list[tuple[int, bool, datetime]],
+                                db: AsyncSession) -> dict[int, int]:
+    """Apply votes [(post_id, is_like, created_at)] of the user (already stored
+    in postgres) to redis in one pipeline and return new ratings of the posts.
+    While redis is unavailable the ratings are read from the db"""
+
+    try:
+        return await apply_votes(user_uuid, votes, db)
+    except BreakerError:
+        stale_posts.update(post_id for post_id, _, _ in votes)
+        return await get_db_ratings([post_id for post_id, _, _ in votes], db)
+
+
+async def apply_votes(user_uuid, votes: list[tuple[int, bool, datetime]], db: AsyncSession) -> dict[int, int]:
+    """Apply the votes to redis in one pipeline, posts not synced yet are
+    synced and their votes applied again in a second one. Redis failures
+    are raised as BreakerError"""
+
+    async def run_pipeline(batch):
+        async with redis.pipeline(transaction=False) as pipe:
+            for post_id, is_like, created_at in batch:
+                await vote_cache.layout.queue_vote(pipe, post_id, user_uuid, 1 if is_like else -1,
+                                                   leaderboard.age_term(created_at) if created_at else '')
+            return await pipe.execute()
+
+    results = await redis_breaker.call(run_pipeline, votes)
+    ratings = {post_id: rating for (post_id, _, _), rating in zip(votes, results) if rating is not None}
+
+    unsynced = [vote for vote, rating in zip(votes, results) if rating is None]
+    if unsynced:
+        await sync_redis_locked([post_id for post_id, _, _ in unsynced], db)
+        results = await redis_breaker.call(run_pipeline, unsynced)
+        ratings.update({post_id: rating for (post_id, _, _), rating in zip(unsynced, results)
+                        if rating is not None})
 
-        vote_key = f'vote:{post_id}:{user_uuid}'
-        votes_result = f'vote:{post_id}:result'
+    return ratings
 
-        vote_in_redis = await red.get(vote_key)
 
-        if not vote_in_redis:
-            await (red.set(vote_key, 1) if is_like is True else red.set(vote_key, -1))
-            await (red.incr(votes_result) if is_like else red.decr(votes_result))
+async def update_leaderboards(post_id: int, rating: int, created_at: datetime | None, published: bool):
+    """Put the post into the top and trending sets or drop it from them
+    (unpublished or deleted). While redis is unavailable the post is left
+    to be reconciled once it recovers"""
+
+    try:
+        if published:
+            await redis_breaker.call(leaderboard.update_post, post_id, rating, created_at)
+        else:
+            await redis_breaker.call(leaderboard.remove_post, post_id)
+    except BreakerError:
+        stale_posts.add(post_id)
+
+
+# posts whose votes or leaderboard entries were changed in postgres only,
+# because redis was unavailable. Resynced once it recovers
+stale_posts: set[int] = set()
+
+
+async def resync_posts(post_ids: list[int], db: AsyncSession):
+    """Rewrite votes, ratings and leaderboard entries of the posts from the db.
+    Redis failures are raised as BreakerError"""
+
+    ratings = await sync_redis_bulk(post_ids, db)
+
+    rows = await db.execute(select(Post.id, Post.created_at).where(
+        Post.id.in_(post_ids), Post.published))
+    published = dict(rows.all())
+
+    for post_id in post_ids:
+        if post_id in published:
+            await redis_breaker.call(leaderboard.update_post, post_id, ratings[post_id], published[post_id])
         else:
-            if int(vote_in_redis) == 1:
-                if is_like:
-                    pass
-                else:
-                    await red.set(vote_key, -1)
-                    await red.decr(votes_result)
-                    await red.decr(votes_result)
-            else:
-                if not is_like:
-                    pass
-                else:
-                    await red.set(vote_key, 1)
-                    await red.incr(votes_result)
-                    await red.incr(votes_result)
+            await redis_breaker.call(leaderboard.remove_post, post_id)
+
+
+@redis_breaker.on_recover
+async def reconcile_stale_posts():
+    """Bring redis in line with postgres for the posts changed during the outage"""
+
+    if not stale_posts:
+        return
 
+    post_ids = list(stale_posts)
+    async with async_session_maker() as db:
+        await resync_posts(post_ids, db)
+    stale_posts.difference_update(post_ids)
@@ -0,0 +1,298 @@
+"""Redis layouts of the vote cache.
+
+keys: vote:{post_id}:{user_uuid} = 1/-1 for every vote and vote:{post_id}:result
+      with the rating of the post
+hash: votes:{post_id} hash per post, field = user uuid as 16 raw bytes, value = 1/-1,
+      the rating is kept in the same hash under the field 'r'
+
+In both layouts the rating being present means all the votes of the post are
+in redis too. The layout is chosen by VOTE_CACHE_LAYOUT.
+
+    python -m app.vote_cache migrate    # move the keys layout into hashes
+"""
+import argparse
+import asyncio
+import time
+from collections import defaultdict
+from uuid import UUID
+
+from app import leaderboard
+from app.redis_conn import redis
+from environ import VOTE_CACHE_LAYOUT
+
+
+# Shared tail of the vote scripts: `rating` is the new rating of the post,
+# KEYS[n], KEYS[n+1] - top and trending sets, ARGV[2] - post id,
+# ARGV[3] - time part of the trending score (may be empty)
+UPDATE_LEADERBOARDS_LUA = """
+redis.call('ZADD', KEYS[#KEYS - 1], rating, ARGV[2])
+if ARGV[3] ~= '' then
+    local sign = rating > 0 and 1 or (rating < 0 and -1 or 0)
+    local hot = sign * math.log10(math.max(math.abs(rating), 1)) + tonumber(ARGV[3])
+    redis.call('ZADD', KEYS[#KEYS], hot, ARGV[2])
+end
+return rating
+"""
+
+
+def uuid_bytes(user_uuid) -> bytes:
+    return (user_uuid if isinstance(user_uuid, UUID) else UUID(str(user_uuid))).bytes
+
+
+class KeysLayout:
+    """A string key per vote plus a rating key per post"""
+
+    # KEYS[1] - vote:{post_id}:result, KEYS[2] - vote:{post_id}:{user_uuid}, KEYS[3], KEYS[4] - leaderboards,
+    # ARGV[1] - 1 or -1. Returns nil if votes of the post are not synced yet, otherwise the new rating
+    APPLY_VOTE_LUA = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return false
+end
+local new = tonumber(ARGV[1])
+local old = tonumber(redis.call('GET', KEYS[2]) or '0')
+if old == new then
+    return tonumber(redis.call('GET', KEYS[1]))
+end
+redis.call('SET', KEYS[2], new)
+local rating = redis.call('INCRBY', KEYS[1], new - old)
+""" + UPDATE_LEADERBOARDS_LUA
+
+    # KEYS[1] - vote:{post_id}:result, KEYS[2..] - vote:{post_id}:{user_uuid}, ARGV[1] - the rating,
+    # ARGV[2..] - votes of KEYS[2..]. Nothing is written if the post is synced already
+    FILL_POST_LUA = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    return 0
+end
+for i = 2, #KEYS do
+    redis.call('SET', KEYS[i], ARGV[i])
+end
+redis.call('SET', KEYS[1], ARGV[1])
+return 1
+"""
+
+    def __init__(self):
+        self.apply_vote_script = redis.register_script(self.APPLY_VOTE_LUA)
+        self.fill_post_script = redis.register_script(self.FILL_POST_LUA)
+
+    async def read_ratings(self, post_ids: list[int]) -> list[bytes | None]:
+        return await redis.mget([f'vote:{post_id}:result' for post_id in post_ids])
+
+    def write_post(self, pipe, post_id: int, rating: int, votes):
+        """Queue the votes [(user_uuid, is_like)] and the rating of the post on the pipeline"""
+
+        mapping = {f'vote:{post_id}:{user_uuid}': 1 if is_like else -1 for user_uuid, is_like in votes}
+        # keys are set in order, the rating comes last
+        mapping[f'vote:{post_id}:result'] = rating
+        pipe.mset(mapping)
+
+    async def fill_post(self, pipe, post_id: int, rating: int, votes):
+        """Queue writing the votes and the rating of the post on the pipeline unless
+        the post has a rating already. Its result is 1 if the post was written"""
+
+        votes = list(votes)
+        keys = [f'vote:{post_id}:result', *(f'vote:{post_id}:{user_uuid}' for user_uuid, _ in votes)]
+        args = [rating, *(1 if is_like else -1 for _, is_like in votes)]
+        await self.fill_post_script(keys=keys, args=args, client=pipe)
+
+    def vote_script_args(self, post_id: int, user_uuid, vote: int, age_term) -> tuple[list, list]:
+        keys = [f'vote:{post_id}:result', f'vote:{post_id}:{user_uuid}',
+                leaderboard.TOP_KEY, leaderboard.TRENDING_KEY]
+        return keys, [vote, post_id, age_term]
+
+    async def apply_vote(self, post_id: int, user_uuid, vote: int, age_term) -> int | None:
+        keys, args = self.vote_script_args(post_id, user_uuid, vote, age_term)
+        return await self.apply_vote_script(keys=keys, args=args)
+
+    async def queue_vote(self, pipe, post_id: int, user_uuid, vote: int, age_term):
+        """Queue the vote script on the pipeline, its result is the one of apply_vote"""
+
+        keys, args = self.vote_script_args(post_id, user_uuid, vote, age_term)
+        await self.apply_vote_script(keys=keys, args=args, client=pipe)
+
+    async def read_votes(self, post_id: int, user_uuids: list) -> tuple[int | None, list[int | None]]:
+        """Rating of the post and votes of the users, None if missing"""
+
+        values = await redis.mget([f'vote:{post_id}:result',
+                                   *(f'vote:{post_id}:{user_uuid}' for user_uuid in user_uuids)])
+        rating, *votes = [int(value) if value is not None else None for value in values]
+        return rating, votes
+
+    async def delete_post(self, post_id: int, user_uuids: list = ()):
+        await redis.delete(f'vote:{post_id}:result',
+                           *(f'vote:{post_id}:{user_uuid}' for user_uuid in user_uuids))
+
+
+class HashLayout:
+    """A hash per post with the votes and the rating"""
+
+    RATING_FIELD = 'r'
+
+    # KEYS[1] - votes:{post_id}, KEYS[2], KEYS[3] - leaderboards, ARGV[1] - 1 or -1,
+    # ARGV[4] - user uuid bytes. Returns nil if votes of the post are not synced yet, otherwise the new rating
+    APPLY_VOTE_LUA = """
+local current = redis.call('HGET', KEYS[1], 'r')
+if not current then
+    return false
+end
+local new = tonumber(ARGV[1])
+local old = tonumber(redis.call('HGET', KEYS[1], ARGV[4]) or '0')
+if old == new then
+    return tonumber(current)
+end
+redis.call('HSET', KEYS[1], ARGV[4], new)
+local rating = redis.call('HINCRBY', KEYS[1], 'r', new - old)
+""" + UPDATE_LEADERBOARDS_LUA
+
+    # KEYS[1] - votes:{post_id}, ARGV[1] - the rating, ARGV[2..] - user uuid bytes and vote pairs.
+    # Nothing is written if the post is synced already
+    FILL_POST_LUA = """
+if redis.call('HEXISTS', KEYS[1], 'r') == 1 then
+    return 0
+end
+for i = 2, #ARGV, 2 do
+    redis.call('HSET', KEYS[1], ARGV[i], ARGV[i + 1])
+end
+redis.call('HSET', KEYS[1], 'r', ARGV[1])
+return 1
+"""
+
+    def __init__(self):
+        self.apply_vote_script = redis.register_script(self.APPLY_VOTE_LUA)
+        self.fill_post_script = redis.register_script(self.FILL_POST_LUA)
+
+    async def read_ratings(self, post_ids: list[int]) -> list[bytes | None]:
+        async with redis.pipeline(transaction=False) as pipe:
+            for post_id in post_ids:
+                pipe.hget(f'votes:{post_id}', self.RATING_FIELD)
+            return await pipe.execute()
+
+    def write_post(self, pipe, post_id: int, rating: int, votes):
+        """Queue the votes [(user_uuid, is_like)] and the rating of the post on the pipeline"""
+
+        mapping = {uuid_bytes(user_uuid): 1 if is_like else -1 for user_uuid, is_like in votes}
+        mapping[self.RATING_FIELD] = rating
+        pipe.delete(f'votes:{post_id}')
+        pipe.hset(f'votes:{post_id}', mapping=mapping)
+
+    async def fill_post(self, pipe, post_id: int, rating: int, votes):
+        """Queue writing the votes and the rating of the post on the pipeline unless
+        the post has a rating already. Its result is 1 if the post was written"""
+
+        args = [rating]
+        for user_uuid, is_like in votes:
+            args.extend((uuid_bytes(user_uuid), 1 if is_like else -1))
+        await self.fill_post_script(keys=[f'votes:{post_id}'], args=args, client=pipe)
+
+    def vote_script_args(self, post_id: int, user_uuid, vote: int, age_term) -> tuple[list, list]:
+        keys = [f'votes:{post_id}', leaderboard.TOP_KEY, leaderboard.TRENDING_KEY]
+        return keys, [vote, post_id, age_term, uuid_bytes(user_uuid)]
+
+    async def apply_vote(self, post_id: int, user_uuid, vote: int, age_term) -> int | None:
+        keys, args = self.vote_script_args(post_id, user_uuid, vote, age_term)
+        return await self.apply_vote_script(keys=keys, args=args)
+
+    async def queue_vote(self, pipe, post_id: int, user_uuid, vote: int, age_term):
+        """Queue the vote script on the pipeline, its result is the one of apply_vote"""
+
+        keys, args = self.vote_script_args(post_id, user_uuid, vote, age_term)
+        await self.apply_vote_script(keys=keys, args=args, client=pipe)
+
+    async def read_votes(self, post_id: int, user_uuids: list) -> tuple[int | None, list[int | None]]:
+        """Rating of the post and votes of the users, None if missing"""
+
+        values = await redis.hmget(f'votes:{post_id}',
+                                   [self.RATING_FIELD, *(uuid_bytes(user_uuid) for user_uuid in user_uuids)])
+        rating, *votes = [int(value) if value is not None else None for value in values]
+        return rating, votes
+
+    async def delete_post(self, post_id: int, user_uuids: list = ()):
+        await redis.delete(f'votes:{post_id}')
+
+
+LAYOUTS = {'keys': KeysLayout, 'hash': HashLayout}
+
+layout = LAYOUTS[VOTE_CACHE_LAYOUT]()
+
+
+# KEYS[1] - votes:{post_id}, ARGV - user uuid bytes and vote pairs. A hash without
+# a rating gets the votes as they are. A hash with one was synced from the db or
+# voted into meanwhile: votes of users it already has are newer and kept, the
+# others (e.g. write-behind votes not flushed yet) are added along with the rating
+MIGRATE_VOTES_LUA = """
+local synced = redis.call('HEXISTS', KEYS[1], 'r') == 1
+local added = 0
+for i = 1, #ARGV, 2 do
+    if redis.call('HSETNX', KEYS[1], ARGV[i], ARGV[i + 1]) == 1 then
+        added = added + 1
+        if synced then
+            redis.call('HINCRBY', KEYS[1], 'r', ARGV[i + 1])
+        end
+    end
+end
+return added
+"""
+
+
+async def migrate_keys_to_hash(batch: int = 1000) -> dict:
+    """Move the keys layout into hashes without touching postgres. Run it with
+    VOTE_CACHE_LAYOUT=hash already deployed and nothing writing the keys layout
+    anymore. Posts not migrated yet are synced from the db on a miss, which
+    lacks write-behind votes not flushed yet: such votes are merged into the
+    synced hash and its rating, while votes the hash already has are newer
+    and kept. Leaderboard scores catch up on the next vote of the post.
+
+    Per-user votes are moved first and ratings last, so a hash never has the
+    rating without all its votes"""
+
+    started = time.perf_counter()
+    votes = ratings = 0
+
+    async for keys in scan_batches('vote:*', batch):
+        # vote:{post_id}:{user_uuid}, ratings and locks are left for later
+        keys = [key for key in keys if not key.endswith((b':result', b':lock'))]
+        if not keys:
+            continue
+
+        posts = defaultdict(list)
+        for key, value in zip(keys, await redis.mget(keys)):
+            if value is not None:
+                _, post_id, user_uuid = key.decode().split(':', 2)
+                posts[post_id].extend((uuid_bytes(user_uuid), value))
+
+        async with redis.pipeline(transaction=False) as pipe:
+            for post_id, fields in posts.items():
+                pipe.eval(MIGRATE_VOTES_LUA, 1, f'votes:{post_id}', *fields)
+            pipe.unlink(*keys)
+            await pipe.execute()
+        votes += len(keys)
+
+    async for keys in scan_batches('vote:*:result', batch):
+        async with redis.pipeline(transaction=False) as pipe:
+            for key, value in zip(keys, await redis.mget(keys)):
+                if value is not None:
+                    pipe.hsetnx(f'votes:{key.decode().split(":")[1]}', HashLayout.RATING_FIELD, value)
+            pipe.unlink(*keys)
+            await pipe.execute()
+        ratings += len(keys)
+
+    return {'votes': votes, 'ratings': ratings, 'elapsed_s': round(time.perf_counter() - started, 3)}
+
+
+async def scan_batches(match: str, batch: int):
+    """Yield lists of keys matching the pattern, SCAN does not block redis like KEYS"""
+
+    cursor = 0
+    while True:
+        cursor, keys = await redis.scan(cursor, match=match, count=batch)
+        if keys:
+            yield keys
+        if cursor == 0:
+            return
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('command', choices=['migrate'])
+    parser.add_argument('--batch', type=int, default=1000)
+    args = parser.parse_args()
+    print(asyncio.run(migrate_keys_to_hash(args.batch)))
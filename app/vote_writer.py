@@ -0,0 +1,202 @@
+import asyncio
+import logging
+import os
+import socket
+import time
+from uuid import UUID
+
+from aioredis.exceptions import ResponseError
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert
+
+from app import metrics
+from app.db.models import Vote, Post
+from app.db.session import async_session_maker
+from app.redis_conn import redis, blocking_redis
+from environ import VOTE_FLUSH_BATCH_SIZE, VOTE_FLUSH_INTERVAL
+
+
+logger = logging.getLogger(__name__)
+
+
+STREAM = 'votes:stream'
+GROUP = 'vote-writers'
+CONSUMER = f'{socket.gethostname()}-{os.getpid()}'
+
+# pending entries idle for longer than this are taken over from dead consumers
+CLAIM_IDLE_MS = 60_000
+
+# Consumer state, lag_seconds is the age of the newest flushed vote at flush time
+stats = {
+    'flushed': 0,
+    'batches': 0,
+    'failed_batches': 0,
+    'lag_seconds': 0.0,
+    'last_flush_at': None,
+}
+
+metrics.register(metrics.Gauge('vote_writer_flushed_total', 'Votes flushed to postgres',
+                               lambda: stats['flushed'], 'counter'))
+metrics.register(metrics.Gauge('vote_writer_failed_batches_total', 'Vote batches failed to flush',
+                               lambda: stats['failed_batches'], 'counter'))
+metrics.register(metrics.Gauge('vote_writer_lag_seconds', 'Age of the newest flushed vote at flush time',
+                               lambda: stats['lag_seconds']))
+
+
+def queue_enqueue(pipe, post_id: int, user_uuid, is_like: bool):
+    """Queue appending the vote to the redis stream on the pipeline, to be
+    flushed to postgres later"""
+
+    pipe.xadd(STREAM, {'post_id': post_id,
+                       'user_uuid': str(user_uuid),
+                       'is_like': int(is_like)})
+
+
+# low bits of a vote seq taken by the sequence part of the stream entry id
+SEQ_BITS = 20
+SEQ_MASK = (1 << SEQ_BITS) - 1
+
+
+def entry_seq(entry_id: bytes) -> int:
+    """Order of the vote in the stream entry as the vote.seq number"""
+
+    ms, sequence = entry_id.split(b'-')
+    return int(ms) << SEQ_BITS | min(int(sequence), SEQ_MASK)
+
+
+def now_seq() -> int:
+    """vote.seq of a vote written to postgres directly, ahead of the votes
+    queued so far"""
+
+    return int(time.time() * 1000) << SEQ_BITS | SEQ_MASK
+
+
+async def ensure_group():
+    """Create the consumer group (and the stream) if it does not exist"""
+
+    try:
+        await redis.xgroup_create(STREAM, GROUP, id='0', mkstream=True)
+    except ResponseError as e:
+        if 'BUSYGROUP' not in str(e):
+            raise
+
+
+def entry_age(entry_id: bytes) -> float:
+    """Seconds passed since the stream entry was added"""
+
+    ms = int(entry_id.split(b'-')[0])
+    return max(time.time() - ms / 1000, 0.0)
+
+
+async def flush(entries: list) -> None:
+    """Write a batch of stream entries to the vote table and acknowledge them"""
+
+    # the last vote of the user for the post wins, ON CONFLICT can't touch a row twice
+    votes = {}
+    for entry_id, fields in entries:
+        key = (UUID(fields[b'user_uuid'].decode()), int(fields[b'post_id']))
+        votes[key] = (fields[b'is_like'] == b'1', entry_seq(entry_id))
+
+    async with async_session_maker() as session:
+        post_ids = {post_id for _, post_id in votes}
+        existing = set((await session.execute(
+            select(Post.id).where(Post.id.in_(post_ids)))).scalars())
+
+        # the counter trigger locks the post row of every vote, rows go in post id
+        # order like in the other vote paths, so concurrent writers don't deadlock
+        rows = [{'user_uuid': user_uuid, 'post_id': post_id, 'is_like': is_like, 'seq': seq}
+                for (user_uuid, post_id), (is_like, seq) in sorted(votes.items(), key=lambda kv: (kv[0][1], kv[0][0]))
+                if post_id in existing]
+
+        if rows:
+            stmt = insert(Vote).values(rows)
+            # consumers flush batches concurrently, a vote never overwrites a later one
+            stmt = stmt.on_conflict_do_update(index_elements=[Vote.user_uuid, Vote.post_id],
+                                              set_={'is_like': stmt.excluded.is_like,
+                                                    'seq': stmt.excluded.seq},
+                                              where=Vote.seq < stmt.excluded.seq)
+            await session.execute(stmt)
+            await session.commit()
+
+    ids = [entry_id for entry_id, _ in entries]
+    async with redis.pipeline(transaction=False) as pipe:
+        pipe.xack(STREAM, GROUP, *ids)
+        pipe.xdel(STREAM, *ids)
+        await pipe.execute()
+
+    stats['flushed'] += len(entries)
+    stats['batches'] += 1
+    stats['lag_seconds'] = entry_age(ids[-1])
+    stats['last_flush_at'] = time.time()
+
+
+def next_entry_id(entry_id: bytes) -> str:
+    """The smallest stream entry id after entry_id"""
+
+    ms, sequence = entry_id.decode().split('-')
+    return f'{ms}-{int(sequence) + 1}'
+
+
+async def claim_stale() -> int:
+    """Take over votes left unacknowledged by consumers that are gone,
+    paging through all the pending entries of the group. Return the number
+    of claimed votes, they are pending for this consumer afterwards"""
+
+    claimed = 0
+    start = '-'
+    while True:
+        pending = await redis.xpending_range(STREAM, GROUP, min=start, max='+', count=VOTE_FLUSH_BATCH_SIZE)
+        if not pending:
+            return claimed
+
+        stale = [entry['message_id'] for entry in pending
+                 if entry['time_since_delivered'] >= CLAIM_IDLE_MS and entry['consumer'] != CONSUMER.encode()]
+        if stale:
+            await redis.xclaim(STREAM, GROUP, CONSUMER, CLAIM_IDLE_MS, stale)
+            logger.info('Claimed %s pending votes', len(stale))
+            claimed += len(stale)
+
+        start = next_entry_id(pending[-1]['message_id'])
+
+
+async def run(stop: asyncio.Event):
+    """Consume the votes stream and flush votes to postgres in batches
+    until stop is set. Every CLAIM_IDLE_MS votes left pending by dead
+    consumers are claimed and flushed too, a restarted worker has a new
+    consumer name and never reads its old pending votes itself"""
+
+    # own pending entries ('0') are read first, then new ones ('>')
+    last_id = '0'
+    group_ready = False
+    next_claim = 0.0
+    while not stop.is_set():
+        try:
+            if not group_ready:
+                await ensure_group()
+                group_ready = True
+
+            if time.monotonic() >= next_claim:
+                next_claim = time.monotonic() + CLAIM_IDLE_MS / 1000
+                if await claim_stale():
+                    last_id = '0'
+
+            response = await blocking_redis.xreadgroup(GROUP, CONSUMER, {STREAM: last_id},
+                                                       count=VOTE_FLUSH_BATCH_SIZE,
+                                                       block=int(VOTE_FLUSH_INTERVAL * 1000))
+            entries = response[0][1] if response else []
+
+            if entries:
+                await flush(entries)
+            elif last_id == '0':
+                last_id = '>'
+            else:
+                stats['lag_seconds'] = 0.0
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            stats['failed_batches'] += 1
+            logger.exception('Failed to flush votes, retrying')
+            # the group is gone if the stream was flushed, it is recreated
+            group_ready = False
+            last_id = '0'
+            await asyncio.sleep(VOTE_FLUSH_INTERVAL)
@@ -0,0 +1,111 @@
+"""Bulk fill of the redis vote cache from postgres.
+
+Votes are aggregated by post in the db and streamed in chunks through a
+server-side cursor, every chunk is written to redis with a single pipeline
+of fill scripts. A post that already has a rating in redis is left alone,
+its cached votes may be newer than postgres. Leaderboards are rebuilt
+afterwards. Nothing is done while write-behind votes are still queued.
+
+    python -m app.warmup [--chunk-size 1000] [--skip-leaderboards]
+"""
+import argparse
+import asyncio
+import logging
+import time
+
+from sqlalchemy import select, func, case
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app import leaderboard, vote_cache, vote_writer
+from app.db.models import Vote
+from app.db.session import async_session_maker, engine
+from app.redis_conn import redis
+from environ import WARMUP_CHUNK_SIZE
+
+
+logger = logging.getLogger(__name__)
+
+
+# only one worker warms the cache up when several start at once
+LOCK_KEY = 'warmup:lock'
+LOCK_TTL = 600
+
+
+async def rebuild_vote_cache(db: AsyncSession, chunk_size: int = WARMUP_CHUNK_SIZE) -> dict:
+    """Write per-user votes and ratings of every voted post missing in redis.
+    Return counts and throughput of the rebuild"""
+
+    stmt = select(Vote.post_id,
+                  func.sum(case((Vote.is_like, 1), else_=-1)),
+                  func.array_agg(Vote.user_uuid),
+                  func.array_agg(Vote.is_like)).group_by(Vote.post_id)
+
+    posts = votes = skipped = 0
+    started = time.perf_counter()
+
+    result = await db.stream(stmt.execution_options(yield_per=chunk_size))
+    async for rows in result.partitions():
+        async with redis.pipeline(transaction=False) as pipe:
+            for post_id, rating, user_uuids, likes in rows:
+                await vote_cache.layout.fill_post(pipe, post_id, int(rating), zip(user_uuids, likes))
+                votes += len(user_uuids)
+            skipped += (await pipe.execute()).count(0)
+
+        posts += len(rows)
+        elapsed = time.perf_counter() - started
+        logger.info('Vote cache: %s posts, %s votes, %.0f votes/s', posts, votes, votes / elapsed)
+
+    elapsed = time.perf_counter() - started
+    return {
+        'posts': posts,
+        'votes': votes,
+        'skipped_posts': skipped,
+        'elapsed_s': round(elapsed, 3),
+        'rows_per_s': round(votes / elapsed, 1) if elapsed else None,
+    }
+
+
+async def warmup(leaderboards: bool = True, chunk_size: int = WARMUP_CHUNK_SIZE,
+                 only_cold: bool = False) -> dict | None:
+    """Fill the vote cache (and rebuild leaderboards) unless another worker is
+    already doing it. With only_cold nothing is done if the leaderboards are
+    in redis, i.e. the cache is live. Return the stats of the rebuild"""
+
+    if only_cold and await redis.exists(leaderboard.TOP_KEY):
+        logger.info('Vote cache is live, skipping the warmup')
+        return None
+
+    if await redis.xlen(vote_writer.STREAM):
+        # queued votes are in redis but not in postgres yet
+        logger.warning('Write-behind votes are not flushed yet, skipping the warmup')
+        return None
+
+    if not await redis.set(LOCK_KEY, 1, nx=True, ex=LOCK_TTL):
+        logger.info('Vote cache warmup is already running in another worker')
+        return None
+
+    try:
+        async with async_session_maker() as session:
+            stats = await rebuild_vote_cache(session, chunk_size)
+            if leaderboards:
+                stats['leaderboard_posts'] = await leaderboard.rebuild(session)
+    finally:
+        await redis.delete(LOCK_KEY)
+
+    logger.info('Vote cache warmed up: %s', stats)
+    return stats
+
+
+async def main(args):
+    try:
+        await warmup(not args.skip_leaderboards, args.chunk_size)
+    finally:
+        await engine.dispose()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--chunk-size', type=int, default=WARMUP_CHUNK_SIZE)
+    parser.add_argument('--skip-leaderboards', action='store_true')
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s')
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,67 @@
+import json
+import os
+import platform
+import statistics
+import subprocess
+import time
+from datetime import datetime
+
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), 'results')
+
+
+def percentiles(samples: list[float]) -> dict:
+    """p50/p95/p99 of latency samples (seconds) in milliseconds"""
+
+    if len(samples) < 2:
+        value = round(samples[0] * 1000, 2) if samples else None
+        return {'p50_ms': value, 'p95_ms': value, 'p99_ms': value}
+
+    cuts = statistics.quantiles(samples, n=100)
+    return {'p50_ms': round(cuts[49] * 1000, 2),
+            'p95_ms': round(cuts[94] * 1000, 2),
+            'p99_ms': round(cuts[98] * 1000, 2)}
+
+
+def summarize(name: str, samples: list[float], errors: int, elapsed: float) -> dict:
+    """Throughput and latency summary of a scenario"""
+
+    return {
+        'scenario': name,
+        'requests': len(samples),
+        'errors': errors,
+        'elapsed_s': round(elapsed, 3),
+        'throughput_rps': round(len(samples) / elapsed, 1) if elapsed else None,
+        **percentiles(samples),
+    }
+
+
+def git_revision() -> str | None:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def write_report(benchmark: str, report: dict, output: str | None = None) -> str:
+    """Wrap the report with run metadata, print it and save it as JSON,
+    so runs can be compared over time. Return the path of the file"""
+
+    report = {
+        'benchmark': benchmark,
+        'started_at': datetime.utcnow().isoformat(),
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        **report,
+    }
+
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        output = os.path.join(RESULTS_DIR, f'{benchmark}-{int(time.time())}.json')
+
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    print(json.dumps(report, indent=2))
+    return output
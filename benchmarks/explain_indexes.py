@@ -0,0 +1,91 @@
+"""Checks that the author feed and the rating aggregate use their indexes.
+
+Seeds users, posts and votes (benchmarks.seed), ANALYZEs the tables and
+runs EXPLAIN for the queries of GET /users/{uuid}/posts (first and next
+page) and of the rating sync with the default planner settings, so the
+check fails if the planner would not pick the expected index on realistic
+data. Exits nonzero then (`make check` runs it). Seeded data is deleted
+afterwards unless --keep-data is passed.
+
+    python -m benchmarks.explain_indexes --users 1000 --posts 10000 --votes-per-post 20
+"""
+import argparse
+import asyncio
+import random
+import sys
+import uuid
+
+from sqlalchemy import text, select
+from sqlalchemy.dialects import postgresql
+
+from app import utils
+from app.db.models import Post
+from app.db.session import async_session_maker, engine
+from app.repositories.posts import PostRepository
+from benchmarks.common import write_report
+from benchmarks.seed import seed, cleanup
+
+
+def compile_query(stmt) -> str:
+    return str(stmt.compile(dialect=postgresql.dialect(), compile_kwargs={'literal_binds': True}))
+
+
+async def explain(session, stmt) -> str:
+    result = await session.execute(text(f'EXPLAIN {compile_query(stmt)}'))
+    return '\n'.join(row[0] for row in result)
+
+
+async def run(users: int, posts: int, votes_per_post: int, keep_data: bool) -> dict:
+    report = {'users': users, 'posts': posts, 'votes_per_post': votes_per_post}
+    try:
+        data = await seed(users, posts, votes_per_post)
+
+        async with engine.connect() as conn:
+            await conn.execute(text('ANALYZE post'))
+            await conn.execute(text('ANALYZE vote'))
+
+        author_id = uuid.UUID(random.choice(data['posts'])['author_id'])
+        post_ids = [post['id'] for post in random.sample(data['posts'], 3)]
+
+        async with async_session_maker() as session:
+            # the next page starts after the first post of the author
+            first = (await session.execute(select(Post.created_at, Post.id).filter(
+                Post.author_id == author_id).order_by(Post.created_at, Post.id).limit(1))).one()
+            cursor = utils.encode_cursor(first.created_at, first.id)
+
+            checks = {
+                'author_feed_first_page': (PostRepository.author_feed_query(author_id),
+                                           'ix_post_author_id_created_at_id'),
+                'author_feed_next_page': (PostRepository.author_feed_query(author_id, cursor),
+                                          'ix_post_author_id_created_at_id'),
+                'votes_aggregate': (utils.votes_aggregate_query(post_ids), 'ix_vote_post_id'),
+            }
+            for name, (stmt, index) in checks.items():
+                plan = await explain(session, stmt)
+                report[name] = {'index': index, 'uses_index': index in plan, 'plan': plan}
+    finally:
+        if not keep_data:
+            await cleanup()
+        await engine.dispose()
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--posts', type=int, default=10000)
+    parser.add_argument('--votes-per-post', type=int, default=20)
+    parser.add_argument('--keep-data', action='store_true', help='do not delete seeded data')
+    parser.add_argument('--output', help='report path, benchmarks/results/ by default')
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args.users, args.posts, args.votes_per_post, args.keep_data))
+    write_report('explain_indexes', report, args.output)
+
+    failed = [name for name, check in report.items() if isinstance(check, dict) and not check['uses_index']]
+    if failed:
+        sys.exit(f'queries not using their index: {", ".join(failed)}')
+
+
+if __name__ == '__main__':
+    main()
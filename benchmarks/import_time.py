@@ -0,0 +1,47 @@
+"""Import time of the app module and of building the app.
+
+Runs every snippet in a fresh interpreter REPEAT times and reports the best
+wall time, so the cheap `import app.main` can be compared with the full
+build done by `uvicorn app.main:app`. No db or redis needed.
+
+    python -m benchmarks.import_time --repeat 5
+"""
+import argparse
+import subprocess
+import sys
+import time
+
+from benchmarks.common import write_report
+
+
+SNIPPETS = {
+    'import_main': 'import app.main',
+    'create_app': 'import app.main; app.main.create_app()',
+}
+
+
+def best_time(code: str, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        subprocess.run([sys.executable, '-c', code], check=True)
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--output', help='report path, benchmarks/results/ by default')
+    args = parser.parse_args()
+
+    baseline = best_time('pass', args.repeat)
+    report = {'repeat': args.repeat, 'interpreter_ms': round(baseline * 1000, 1)}
+    for name, code in SNIPPETS.items():
+        report[f'{name}_ms'] = round((best_time(code, args.repeat) - baseline) * 1000, 1)
+
+    write_report('import_time', report, args.output)
+
+
+if __name__ == '__main__':
+    main()
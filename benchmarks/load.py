@@ -0,0 +1,182 @@
+"""Load test of every router against local postgres and redis.
+
+Seeds the data, starts the app with uvicorn (unless --url is given), drives
+each scenario with a concurrent async client and reports throughput and
+p50/p95/p99 latency as JSON under benchmarks/results/.
+
+    make up && alembic upgrade heads
+    python -m benchmarks.load --users 1000 --posts 10000 --votes-per-post 20
+"""
+import argparse
+import asyncio
+import itertools
+import os
+import random
+import subprocess
+import sys
+import time
+import uuid
+
+import httpx
+
+from app.db.session import engine
+from benchmarks.common import summarize, write_report
+from benchmarks.seed import seed, cleanup
+
+
+def auth(user: dict) -> dict:
+    return {'Authorization': f"Bearer {user['token']}"}
+
+
+def scenarios(data: dict) -> dict:
+    """Scenario name -> coroutine function making one request with the client"""
+
+    users, posts, password = data['users'], data['posts'], data['password']
+    cursors = [None]
+
+    async def login(client):
+        user = random.choice(users)
+        return await client.post('/login', data={'username': user['email'], 'password': password})
+
+    async def create_user(client):
+        return await client.post('/users', json={'email': f'bench-{uuid.uuid4().hex}@example.com',
+                                                 'password': password})
+
+    async def list_users(client):
+        return await client.get('/users')
+
+    async def get_user(client):
+        return await client.get(f"/users/{random.choice(users)['uuid']}")
+
+    async def list_posts(client):
+        return await client.get('/posts')
+
+    async def list_posts_deep(client):
+        # walks the listing with cursors, restarting from the first page at the end
+        cursor = random.choice(cursors)
+        response = await client.get('/posts', params={'cursor': cursor} if cursor else None)
+        next_cursor = response.headers.get('X-Next-Cursor')
+        if next_cursor and len(cursors) < 1000:
+            cursors.append(next_cursor)
+        return response
+
+    async def get_post(client):
+        return await client.get(f"/posts/{random.choice(posts)['id']}")
+
+    async def create_post(client):
+        return await client.post('/posts', headers=auth(random.choice(users)),
+                                 json={'title': 'Load test', 'content': 'Load test content'})
+
+    async def vote(client):
+        post = random.choice(posts)
+        user = random.choice(users)
+        while user['uuid'] == post['author_id']:
+            user = random.choice(users)
+        return await client.post('/posts/vote', headers=auth(user),
+                                 params={'post_id': post['id'], 'is_like': random.random() < 0.7})
+
+    return {
+        'auth.login': login,
+        'users.create': create_user,
+        'users.list': list_users,
+        'users.get': get_user,
+        'posts.list': list_posts,
+        'posts.list_cursor': list_posts_deep,
+        'posts.get': get_post,
+        'posts.create': create_post,
+        'posts.vote': vote,
+    }
+
+
+async def drive(client: httpx.AsyncClient, name: str, request, requests: int, concurrency: int) -> dict:
+    """Make `requests` requests with `concurrency` workers and summarize them"""
+
+    samples, errors = [], 0
+    counter = itertools.count()
+
+    async def worker():
+        nonlocal errors
+        while next(counter) < requests:
+            started = time.perf_counter()
+            try:
+                response = await request(client)
+                if response.status_code >= 400:
+                    errors += 1
+            except httpx.HTTPError:
+                errors += 1
+            samples.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return summarize(name, samples, errors, time.perf_counter() - started)
+
+
+def start_server(port: int, workers: int) -> subprocess.Popen:
+    return subprocess.Popen([sys.executable, '-m', 'uvicorn', 'app.main:app',
+                             '--port', str(port), '--workers', str(workers), '--log-level', 'warning'],
+                            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+async def wait_ready(client: httpx.AsyncClient, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if (await client.get('/openapi.json')).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError('The app did not start in time')
+
+
+async def run(args) -> dict:
+    data = await seed(args.users, args.posts, args.votes_per_post)
+    await engine.dispose()
+
+    server = None if args.url else start_server(args.port, args.workers)
+    url = args.url or f'http://127.0.0.1:{args.port}'
+    selected = args.scenario or list(scenarios(data))
+
+    try:
+        limits = httpx.Limits(max_connections=args.concurrency)
+        async with httpx.AsyncClient(base_url=url, timeout=60, limits=limits) as client:
+            await wait_ready(client)
+            available = scenarios(data)
+            results = [await drive(client, name, available[name], args.requests, args.concurrency)
+                       for name in selected]
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+        if not args.keep_data:
+            await cleanup()
+            await engine.dispose()
+
+    return {
+        'config': {'users': args.users, 'posts': args.posts, 'votes_per_post': args.votes_per_post,
+                   'requests': args.requests, 'concurrency': args.concurrency, 'workers': args.workers},
+        'seed_s': data['seed_s'],
+        'results': results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--posts', type=int, default=10000)
+    parser.add_argument('--votes-per-post', type=int, default=20)
+    parser.add_argument('--requests', type=int, default=2000, help='requests per scenario')
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--workers', type=int, default=1, help='uvicorn workers')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--url', help='use an already running app instead of starting one')
+    parser.add_argument('--scenario', action='append', help='run only this scenario, can be repeated')
+    parser.add_argument('--keep-data', action='store_true', help='do not delete seeded data')
+    parser.add_argument('--output', help='report path, benchmarks/results/ by default')
+    args = parser.parse_args()
+
+    write_report('load', asyncio.run(run(args)), args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+"""p99 latency of unrelated GETs during a login storm.
+
+Measures GET /openapi.json latency against a running server, first idle and
+then while LOGINS concurrent logins are hammering bcrypt.
+
+    uvicorn app.main:app &
+    python -m benchmarks.login_storm --url http://localhost:8000
+"""
+import argparse
+import asyncio
+import time
+import uuid
+
+import httpx
+
+from benchmarks.common import percentiles, write_report
+
+
+async def probe(client: httpx.AsyncClient, requests: int) -> list[float]:
+    samples = []
+    for _ in range(requests):
+        started = time.perf_counter()
+        await client.get('/openapi.json')
+        samples.append(time.perf_counter() - started)
+    return samples
+
+
+async def run(url: str, logins: int, probes: int) -> dict:
+    credentials = {'username': f'bench-{uuid.uuid4().hex}@example.com', 'password': 'bench-password'}
+
+    async with httpx.AsyncClient(base_url=url, timeout=60) as client:
+        await client.post('/users', json={'email': credentials['username'],
+                                          'password': credentials['password']})
+
+        idle = await probe(client, probes)
+
+        statuses = {}
+        stop = asyncio.Event()
+
+        async def login_loop():
+            while not stop.is_set():
+                response = await client.post('/login', data=credentials)
+                statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+        storm = [asyncio.create_task(login_loop()) for _ in range(logins)]
+        await asyncio.sleep(0.5)
+        loaded = await probe(client, probes)
+        stop.set()
+        await asyncio.gather(*storm)
+
+    return {
+        'concurrent_logins': logins,
+        'login_statuses': statuses,
+        'idle': percentiles(idle),
+        'during_storm': percentiles(loaded),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--url', default='http://localhost:8000')
+    parser.add_argument('--logins', type=int, default=50)
+    parser.add_argument('--probes', type=int, default=200)
+    parser.add_argument('--output', help='report path, benchmarks/results/ by default')
+    args = parser.parse_args()
+
+    write_report('login_storm', asyncio.run(run(args.url, args.logins, args.probes)), args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+"""Cache stampede check for rating misses.
+
+Fires MISSES concurrent rating lookups of a post missing in redis, split
+across PROCESSES worker processes (each lookup with its own db session),
+and counts the vote counter queries sent to postgres. With single-flight
+within a process, the per-post redis lock across processes and the cached
+counter rating it must be exactly one, also for a post that doesn't exist.
+Exits nonzero otherwise (`make check` runs it).
+
+    python -m benchmarks.rating_stampede --misses 1000 --processes 4
+"""
+import argparse
+import asyncio
+import multiprocessing
+import time
+
+from sqlalchemy import event
+
+from app import vote_cache
+from app.db.session import async_session_maker, engine
+from app.redis_conn import redis
+from app.utils import COUNTER_RATING_KEY, get_post_rating
+from benchmarks.common import write_report
+
+
+# seconds to wait for a worker process, a crashed one fails the check
+RESULT_TIMEOUT = 120
+
+
+async def lookups(post_id: int, misses: int, barrier) -> tuple[int, list[int]]:
+    """Look the rating up misses times at once, return the rating queries sent and the ratings"""
+
+    queries = 0
+
+    def count_rating_queries(conn, cursor, statement, parameters, context, executemany):
+        nonlocal queries
+        if 'dislikes_count' in statement:
+            queries += 1
+
+    async def lookup():
+        async with async_session_maker() as session:
+            return await get_post_rating(post_id, session)
+
+    event.listen(engine.sync_engine, 'before_cursor_execute', count_rating_queries)
+    try:
+        # all the processes miss at the same moment
+        await asyncio.to_thread(barrier.wait)
+        ratings = await asyncio.gather(*(lookup() for _ in range(misses)))
+    finally:
+        event.remove(engine.sync_engine, 'before_cursor_execute', count_rating_queries)
+        await engine.dispose()
+    return queries, ratings
+
+
+def worker(post_id: int, misses: int, barrier, results):
+    results.put(asyncio.run(lookups(post_id, misses, barrier)))
+
+
+async def run(misses: int, post_id: int, processes: int) -> dict:
+    keys = [COUNTER_RATING_KEY.format(post_id), f'rating:{post_id}:lock']
+    await vote_cache.layout.delete_post(post_id)
+    await redis.delete(*keys)
+
+    # spawned, so no process inherits connections of another
+    context = multiprocessing.get_context('spawn')
+    barrier = context.Barrier(processes + 1)
+    results = context.Queue()
+    workers = [context.Process(target=worker, args=(post_id, misses // processes, barrier, results))
+               for _ in range(processes)]
+
+    try:
+        for process in workers:
+            process.start()
+        await asyncio.to_thread(barrier.wait)
+        started = time.perf_counter()
+        outcomes = [await asyncio.to_thread(results.get, timeout=RESULT_TIMEOUT) for _ in workers]
+        elapsed = time.perf_counter() - started
+        for process in workers:
+            await asyncio.to_thread(process.join)
+    finally:
+        for process in workers:
+            if process.is_alive():
+                process.terminate()
+        await vote_cache.layout.delete_post(post_id)
+        await redis.delete(*keys)
+        await engine.dispose()
+
+    queries = sum(count for count, _ in outcomes)
+    return {
+        'misses': misses // processes * processes,
+        'processes': processes,
+        'elapsed_s': round(elapsed, 4),
+        'rating_queries': queries,
+        'distinct_ratings': len({rating for _, ratings in outcomes for rating in ratings}),
+        'single_flight': queries == 1,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--misses', type=int, default=1000)
+    parser.add_argument('--processes', type=int, default=4)
+    parser.add_argument('--post-id', type=int, default=-2,
+                        help='post id to look up, negative ids never clash with real posts')
+    parser.add_argument('--output', help='report path, benchmarks/results/ by default')
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args.misses, args.post_id, args.processes))
+    write_report('rating_stampede', report, args.output)
+    if not report['single_flight']:
+        raise SystemExit(f"{report['rating_queries']} rating queries instead of one")
+
+
+if __name__ == '__main__':
+    main()
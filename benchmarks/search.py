@@ -0,0 +1,130 @@
+"""Latency of the full-text post search on a large table.
+
+Seeds POSTS posts (1M by default) of one benchmark user with random text
+from a zipf-like vocabulary, then runs search queries of several kinds
+(first and next page) and fails if p95 of any budgeted scenario exceeds
+--budget-ms. All matches are ranked before the first page is returned, so
+terms found in a large share of the posts are reported but not budgeted.
+
+    python -m benchmarks.search --posts 1000000 --budget-ms 100
+"""
+import argparse
+import asyncio
+import random
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from sqlalchemy import insert, text
+
+from app.db.models import User, Post
+from app.db.session import async_session_maker, engine
+from app.repositories.posts import PostRepository
+from benchmarks.common import percentiles, write_report
+from benchmarks.seed import EMAIL_PREFIX, cleanup
+
+
+SYLLABLES = ['ka', 'lo', 'mi', 'ne', 'ru', 'ta', 'vi', 'zo', 'pe', 'su', 'ba', 'do']
+
+
+def vocabulary(size: int) -> list[str]:
+    """Distinct pseudo-words, so the stemmer keeps them apart"""
+
+    words = set()
+    rng = random.Random(42)
+    while len(words) < size:
+        words.add(''.join(rng.choices(SYLLABLES, k=rng.randint(2, 4))) + 'x')
+    return sorted(words)
+
+
+async def seed_posts(posts: int, words: list[str], chunk_size: int) -> float:
+    weights = [1 / (rank + 1) for rank in range(len(words))]
+    author = uuid.uuid4()
+    now = datetime.utcnow()
+    started = time.perf_counter()
+
+    async with async_session_maker() as session:
+        await session.execute(insert(User), [{'uuid': author,
+                                              'email': f'{EMAIL_PREFIX}search-{author.hex[:8]}@example.com',
+                                              'password': '-'}])
+        for offset in range(0, posts, chunk_size):
+            rows = [{'title': ' '.join(random.choices(words, weights, k=5)),
+                     'content': ' '.join(random.choices(words, weights, k=40)),
+                     'published': True,
+                     'author_id': author,
+                     'created_at': now - timedelta(seconds=posts - i)}
+                    for i in range(offset, min(offset + chunk_size, posts))]
+            await session.execute(insert(Post), rows)
+        await session.commit()
+
+    async with engine.connect() as conn:
+        await conn.execute(text('ANALYZE post'))
+    return time.perf_counter() - started
+
+
+async def measure(queries: list[str], repeat: int) -> dict:
+    first, following = [], []
+    async with async_session_maker() as session:
+        repo = PostRepository(session, session)
+        for _ in range(repeat):
+            for q in queries:
+                started = time.perf_counter()
+                _, cursor = await repo.search(q)
+                first.append(time.perf_counter() - started)
+
+                if cursor is not None:
+                    started = time.perf_counter()
+                    await repo.search(q, cursor)
+                    following.append(time.perf_counter() - started)
+
+    return {'first_page': percentiles(first), 'next_page': percentiles(following)}
+
+
+async def run(posts: int, vocabulary_size: int, chunk_size: int, repeat: int,
+              budget_ms: float, keep_data: bool) -> dict:
+    words = vocabulary(vocabulary_size)
+    scenarios = {
+        'rare_word': (words[-200:], True),
+        'medium_word': (words[200:400], True),
+        'two_words': ([f'{a} {b}' for a, b in zip(words[50:150], words[150:250])], True),
+        'phrase': ([f'"{a} {b}"' for a, b in zip(words[:100], words[100:200])], True),
+        'common_word': (words[:10], False),
+    }
+
+    report = {'posts': posts, 'vocabulary': vocabulary_size, 'budget_ms': budget_ms}
+    try:
+        report['seed_s'] = round(await seed_posts(posts, words, chunk_size), 3)
+        for name, (queries, budgeted) in scenarios.items():
+            result = await measure(random.sample(queries, min(len(queries), 50)), repeat)
+            worst = max(page['p95_ms'] or 0 for page in result.values())
+            report[name] = {**result, 'budgeted': budgeted, 'within_budget': worst <= budget_ms}
+    finally:
+        if not keep_data:
+            await cleanup()
+        await engine.dispose()
+
+    report['within_budget'] = all(report[name]['within_budget']
+                                  for name, (_, budgeted) in scenarios.items() if budgeted)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--posts', type=int, default=1_000_000)
+    parser.add_argument('--vocabulary', type=int, default=20000)
+    parser.add_argument('--chunk-size', type=int, default=5000)
+    parser.add_argument('--repeat', type=int, default=3, help='runs of every query')
+    parser.add_argument('--budget-ms', type=float, default=100)
+    parser.add_argument('--keep-data', action='store_true', help='do not delete seeded posts')
+    parser.add_argument('--output', help='report path, benchmarks/results/ by default')
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args.posts, args.vocabulary, args.chunk_size, args.repeat,
+                             args.budget_ms, args.keep_data))
+    write_report('search', report, args.output)
+    if not report['within_budget']:
+        raise SystemExit(f'search p95 is over the {args.budget_ms}ms budget')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+"""Seed users, posts and votes for benchmarks.
+
+    python -m benchmarks.seed --users 1000 --posts 10000 --votes-per-post 20
+    python -m benchmarks.seed --cleanup
+"""
+import argparse
+import asyncio
+import random
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, insert
+
+from app.db.models import User, Post, Vote
+from app.db.session import async_session_maker, engine
+from app.oauth2 import create_access_token
+from app.utils import pwd_context
+
+
+EMAIL_PREFIX = 'bench-'
+PASSWORD = 'bench-password'
+CHUNK = 5000
+
+
+def chunks(rows: list, size: int = CHUNK):
+    for i in range(0, len(rows), size):
+        yield rows[i:i + size]
+
+
+async def seed(users: int, posts: int, votes_per_post: int) -> dict:
+    """Insert the data in bulk and return what the load test needs:
+    emails, uuids, tokens and post ids of the seeded data"""
+
+    run = uuid.uuid4().hex[:8]
+    # hashing once is enough, bcrypt would dominate the seeding otherwise
+    password = pwd_context.hash(PASSWORD)
+    now = datetime.utcnow()
+    started = time.perf_counter()
+
+    user_rows = [{'uuid': uuid.uuid4(),
+                  'email': f'{EMAIL_PREFIX}{run}-{i}@example.com',
+                  'password': password,
+                  'created_at': now - timedelta(seconds=users - i)}
+                 for i in range(users)]
+    user_uuids = [row['uuid'] for row in user_rows]
+
+    post_rows = [{'title': f'Benchmark post {i}',
+                  'content': f'Content of benchmark post {i} ' * 10,
+                  'published': True,
+                  'author_id': random.choice(user_uuids),
+                  'created_at': now - timedelta(seconds=posts - i)}
+                 for i in range(posts)]
+
+    post_ids = []
+    async with async_session_maker() as session:
+        for rows in chunks(user_rows):
+            await session.execute(insert(User), rows)
+        for rows in chunks(post_rows):
+            post_ids.extend((await session.execute(insert(Post).returning(Post.id), rows)).scalars())
+
+        vote_rows = []
+        for post_id, post in zip(post_ids, post_rows):
+            voters = random.sample(user_uuids, min(votes_per_post + 1, users))
+            vote_rows.extend({'user_uuid': voter, 'post_id': post_id, 'is_like': random.random() < 0.7}
+                             for voter in voters if voter != post['author_id'])
+        for rows in chunks(vote_rows):
+            await session.execute(insert(Vote), rows)
+
+        await session.commit()
+
+    return {
+        'users': [{'uuid': str(row['uuid']),
+                   'email': row['email'],
+                   'token': create_access_token({'uuid': str(row['uuid'])})} for row in user_rows],
+        'posts': [{'id': post_id, 'author_id': str(post['author_id'])}
+                  for post_id, post in zip(post_ids, post_rows)],
+        'password': PASSWORD,
+        'votes': len(vote_rows),
+        'seed_s': round(time.perf_counter() - started, 3),
+    }
+
+
+async def cleanup():
+    """Delete everything seeded by benchmarks, posts and votes go by cascade"""
+
+    async with async_session_maker() as session:
+        await session.execute(delete(User).where(User.email.startswith(EMAIL_PREFIX)))
+        await session.commit()
+
+
+async def main_async(args):
+    try:
+        if args.cleanup:
+            await cleanup()
+        else:
+            data = await seed(args.users, args.posts, args.votes_per_post)
+            print(f"Seeded {len(data['users'])} users, {len(data['posts'])} posts "
+                  f"and {data['votes']} votes in {data['seed_s']}s")
+    finally:
+        await engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--posts', type=int, default=10000)
+    parser.add_argument('--votes-per-post', type=int, default=20)
+    parser.add_argument('--cleanup', action='store_true', help='delete seeded data and exit')
+    asyncio.run(main_async(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+"""Serialization cost of a listing page, before and after the fast path.
+
+before: PostResponse models are built, re-validated by the response_model,
+        passed through jsonable_encoder and dumped with the stdlib json
+after:  rows are projected to dicts once and dumped with orjson
+
+    python -m benchmarks.serialization --per-page 50
+"""
+import argparse
+import json
+import timeit
+import uuid
+from datetime import datetime
+from types import SimpleNamespace
+
+import orjson
+from fastapi.encoders import jsonable_encoder
+from pydantic import TypeAdapter
+
+from app.schemas import PostResponse
+from benchmarks.common import write_report
+
+
+def make_rows(per_page: int) -> list:
+    return [SimpleNamespace(id=i, title=f'Post {i}', content=f'Content of post {i} ' * 20,
+                            published=True, author_id=uuid.uuid4(), created_at=datetime.utcnow())
+            for i in range(per_page)]
+
+
+def before(rows: list, adapter: TypeAdapter) -> bytes:
+    posts = [PostResponse(id=row.id, title=row.title, content=row.content, published=row.published,
+                          author_id=row.author_id, created_at=row.created_at, rating=7)
+             for row in rows]
+    validated = adapter.validate_python(posts, from_attributes=True)
+    content = jsonable_encoder(adapter.dump_python(validated, mode='json'))
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, indent=None,
+                      separators=(',', ':')).encode('utf-8')
+
+
+def after(rows: list) -> bytes:
+    posts = [{'id': row.id, 'title': row.title, 'content': row.content, 'published': row.published,
+              'author_id': row.author_id, 'created_at': row.created_at, 'rating': 7}
+             for row in rows]
+    return orjson.dumps(posts)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--per-page', type=int, default=50)
+    parser.add_argument('--number', type=int, default=2000)
+    parser.add_argument('--output', help='report path, benchmarks/results/ by default')
+    args = parser.parse_args()
+
+    rows = make_rows(args.per_page)
+    adapter = TypeAdapter(list[PostResponse])
+    assert json.loads(before(rows, adapter)) == json.loads(after(rows))
+
+    before_s = min(timeit.repeat(lambda: before(rows, adapter), number=args.number, repeat=5))
+    after_s = min(timeit.repeat(lambda: after(rows), number=args.number, repeat=5))
+
+    write_report('serialization', {
+        'per_page': args.per_page,
+        'before_us_per_page': round(before_s / args.number * 1e6, 1),
+        'after_us_per_page': round(after_s / args.number * 1e6, 1),
+        'speedup': round(before_s / after_s, 1),
+    }, args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+"""Concurrency benchmark for the atomic vote application in redis.
+
+Fires VOTES parallel votes from USERS different users on a single post and
+checks that the cached rating equals the sum of the per-user votes.
+
+    python -m benchmarks.vote_concurrency --votes 5000 --users 500
+"""
+import argparse
+import asyncio
+import random
+import time
+import uuid
+
+from app import leaderboard, vote_cache
+from app.redis_conn import redis
+from app.utils import change_redis_on_vote
+from benchmarks.common import write_report
+
+
+async def run(votes: int, users: int, concurrency: int, post_id: int) -> dict:
+    user_uuids = [uuid.uuid4() for _ in range(users)]
+
+    layout = vote_cache.layout
+    await layout.delete_post(post_id, user_uuids)
+    # the rating being present means the post is synced, so no db session is needed
+    async with redis.pipeline(transaction=False) as pipe:
+        layout.write_post(pipe, post_id, 0, ())
+        await pipe.execute()
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def vote():
+        async with semaphore:
+            await change_redis_on_vote(post_id, random.choice(user_uuids),
+                                       random.random() < 0.5, db=None)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(vote() for _ in range(votes)))
+    elapsed = time.perf_counter() - started
+
+    result, per_user = await layout.read_votes(post_id, user_uuids)
+    expected = sum(value for value in per_user if value is not None)
+    await layout.delete_post(post_id, user_uuids)
+    await redis.zrem(leaderboard.TOP_KEY, post_id)
+
+    return {
+        'layout': type(layout).__name__,
+        'votes': votes,
+        'users': users,
+        'concurrency': concurrency,
+        'elapsed_s': round(elapsed, 4),
+        'votes_per_s': round(votes / elapsed, 1),
+        'result': result,
+        'expected': expected,
+        'exact': result == expected,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--votes', type=int, default=5000)
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--concurrency', type=int, default=1000)
+    parser.add_argument('--post-id', type=int, default=-1,
+                        help='post id to use for redis keys, negative ids never clash with real posts')
+    parser.add_argument('--output', help='report path, benchmarks/results/ by default')
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args.votes, args.users, args.concurrency, args.post_id))
+    write_report('vote_concurrency', report, args.output)
+    if not report['exact']:
+        raise SystemExit('The cached rating drifted from the per-user votes')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+"""Memory and throughput of the vote cache layouts.
+
+Writes POSTS x VOTES_PER_POST votes (1M by default) in each layout, reports
+redis memory used by them, bulk write throughput and vote application
+throughput. Use an otherwise idle redis db, memory is measured by INFO.
+
+    python -m benchmarks.vote_layouts --posts 10000 --votes-per-post 100
+"""
+import argparse
+import asyncio
+import random
+import time
+import uuid
+
+from app import leaderboard
+from app.redis_conn import redis
+from app.vote_cache import LAYOUTS
+from benchmarks.common import write_report
+
+
+async def used_memory() -> int:
+    return (await redis.info('memory'))['used_memory']
+
+
+async def measure(name: str, posts: int, votes_per_post: int, applied: int,
+                  concurrency: int, chunk: int) -> dict:
+    layout = LAYOUTS[name]()
+    # negative post ids never clash with real posts
+    post_ids = list(range(-1_000_000, -1_000_000 + posts))
+    voters = {post_id: [uuid.uuid4() for _ in range(votes_per_post)] for post_id in post_ids}
+
+    before = await used_memory()
+    started = time.perf_counter()
+    for i in range(0, posts, chunk):
+        async with redis.pipeline(transaction=False) as pipe:
+            for post_id in post_ids[i:i + chunk]:
+                layout.write_post(pipe, post_id, 0, ((voter, random.random() < 0.5) for voter in voters[post_id]))
+            await pipe.execute()
+    write_s = time.perf_counter() - started
+    memory = await used_memory() - before
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def vote():
+        post_id = random.choice(post_ids)
+        async with semaphore:
+            await layout.apply_vote(post_id, random.choice(voters[post_id]), random.choice((1, -1)), '')
+
+    started = time.perf_counter()
+    await asyncio.gather(*(vote() for _ in range(applied)))
+    apply_s = time.perf_counter() - started
+
+    for i in range(0, posts, chunk):
+        await asyncio.gather(*(layout.delete_post(post_id, voters[post_id]) for post_id in post_ids[i:i + chunk]))
+    await redis.zrem(leaderboard.TOP_KEY, *post_ids)
+
+    total = posts * votes_per_post
+    return {
+        'layout': name,
+        'votes': total,
+        'memory_bytes': memory,
+        'bytes_per_vote': round(memory / total, 1),
+        'write_votes_per_s': round(total / write_s, 1),
+        'applied_votes': applied,
+        'apply_votes_per_s': round(applied / apply_s, 1),
+    }
+
+
+async def run(args) -> dict:
+    results = [await measure(name, args.posts, args.votes_per_post, args.applied,
+                             args.concurrency, args.chunk) for name in LAYOUTS]
+    return {'posts': args.posts, 'votes_per_post': args.votes_per_post, 'results': results}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--posts', type=int, default=10000)
+    parser.add_argument('--votes-per-post', type=int, default=100)
+    parser.add_argument('--applied', type=int, default=50000, help='votes applied with the vote script')
+    parser.add_argument('--concurrency', type=int, default=200)
+    parser.add_argument('--chunk', type=int, default=100, help='posts written per pipeline')
+    parser.add_argument('--output', help='report path, benchmarks/results/ by default')
+    args = parser.parse_args()
+
+    write_report('vote_layouts', asyncio.run(run(args)), args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,35 @@
+"""Throughput of the bulk vote cache rebuild.
+
+Rebuilds the redis vote cache from the votes already in postgres (seed them
+with benchmarks.seed first) and reports rows/s. Posts already cached are
+skipped (skipped_posts), so run it against a cold cache.
+
+    python -m benchmarks.warmup --chunk-size 1000
+"""
+import argparse
+import asyncio
+
+from app.db.session import async_session_maker, engine
+from app.warmup import rebuild_vote_cache
+from benchmarks.common import write_report
+
+
+async def run(chunk_size: int) -> dict:
+    try:
+        async with async_session_maker() as session:
+            return {'chunk_size': chunk_size, **await rebuild_vote_cache(session, chunk_size)}
+    finally:
+        await engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--chunk-size', type=int, default=1000)
+    parser.add_argument('--output', help='report path, benchmarks/results/ by default')
+    args = parser.parse_args()
+
+    write_report('warmup', asyncio.run(run(args.chunk_size)), args.output)
+
+
+if __name__ == '__main__':
+    main()
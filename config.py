@@ -1,6 +1,11 @@
 from environ import (POSTGRES_USER, POSTGRES_PASSWORD, POSTGRES_HOST,
-                     POSTGRES_PORT, POSTGRES_DB)
+                     POSTGRES_PORT, POSTGRES_DB, POSTGRES_REPLICA_HOST,
+                     POSTGRES_REPLICA_PORT)
 
 
 DATABASE_URL = f'postgresql+asyncpg://{POSTGRES_USER}:{POSTGRES_PASSWORD}' \
                f'@{POSTGRES_HOST}:{POSTGRES_PORT}/{POSTGRES_DB}'
+
+REPLICA_DATABASE_URL = f'postgresql+asyncpg://{POSTGRES_USER}:{POSTGRES_PASSWORD}' \
+                       f'@{POSTGRES_REPLICA_HOST}:{POSTGRES_REPLICA_PORT}/{POSTGRES_DB}' \
+    if POSTGRES_REPLICA_HOST else None
@@ -20,3 +20,76 @@ SK = os.getenv('SECRET_KEY')
 JWT_EXPIRATION_TIME = int(os.getenv('JWT_EXPIRATION_TIME'))
 
 PER_PAGE = int(os.getenv('PER_PAGE'))
+
+# Write-behind vote ingestion: votes are acknowledged once they are in redis
+# and flushed to postgres in batches by a background consumer
+VOTE_WRITE_BEHIND = os.getenv('VOTE_WRITE_BEHIND', 'false').lower() in ('1', 'true', 'yes')
+VOTE_FLUSH_BATCH_SIZE = int(os.getenv('VOTE_FLUSH_BATCH_SIZE', 500))
+VOTE_FLUSH_INTERVAL = float(os.getenv('VOTE_FLUSH_INTERVAL', 1.0))
+
+# Authenticated user cache: in-process LRU in front of a redis hash
+USER_CACHE_SIZE = int(os.getenv('USER_CACHE_SIZE', 10000))
+USER_CACHE_TTL = float(os.getenv('USER_CACHE_TTL', 60))
+USER_CACHE_REDIS_TTL = int(os.getenv('USER_CACHE_REDIS_TTL', 3600))
+
+# Password hashing: bcrypt cost and the thread pool it runs on
+BCRYPT_ROUNDS = int(os.getenv('BCRYPT_ROUNDS', 12))
+PASSWORD_HASH_WORKERS = int(os.getenv('PASSWORD_HASH_WORKERS', os.cpu_count() or 1))
+PASSWORD_HASH_QUEUE = int(os.getenv('PASSWORD_HASH_QUEUE', 64))
+
+# Single post cache: orjson in redis, optionally fronted by an in-process LRU
+POST_CACHE_TTL = int(os.getenv('POST_CACHE_TTL', 300))
+POST_CACHE_LOCAL_SIZE = int(os.getenv('POST_CACHE_LOCAL_SIZE', 1000))
+POST_CACHE_LOCAL_TTL = float(os.getenv('POST_CACHE_LOCAL_TTL', 5))
+POSTS_PAGE_CACHE_TTL = int(os.getenv('POSTS_PAGE_CACHE_TTL', 60))
+
+# Trending score: a post TRENDING_DECAY seconds newer needs 10x the rating to rank the same
+TRENDING_DECAY = float(os.getenv('TRENDING_DECAY', 45000))
+
+# Rows fetched from the server-side cursor per chunk of the posts export
+EXPORT_CHUNK_SIZE = int(os.getenv('EXPORT_CHUNK_SIZE', 1000))
+
+# Rebuild the redis vote cache from postgres on app startup
+VOTE_CACHE_WARMUP = os.getenv('VOTE_CACHE_WARMUP', 'false').lower() in ('1', 'true', 'yes')
+WARMUP_CHUNK_SIZE = int(os.getenv('WARMUP_CHUNK_SIZE', 1000))
+
+# Syncing votes of a post missing in redis: lock letting one worker sync a post at a time
+RATING_LOCK_TTL = int(os.getenv('RATING_LOCK_TTL', 5000))
+RATING_LOCK_POLL = float(os.getenv('RATING_LOCK_POLL', 0.01))
+
+# Ratings of posts whose votes are not in redis, cached from the vote counters of the posts
+RATING_CACHE_TTL = int(os.getenv('RATING_CACHE_TTL', 30))
+
+# Redis layout of the vote cache: 'keys' - a string key per vote, 'hash' - a hash per post
+VOTE_CACHE_LAYOUT = os.getenv('VOTE_CACHE_LAYOUT', 'keys')
+
+# Optional read replica, pure reads go there unless the client has just written
+POSTGRES_REPLICA_HOST = os.getenv('POSTGRES_REPLICA_HOST')
+POSTGRES_REPLICA_PORT = os.getenv('POSTGRES_REPLICA_PORT', POSTGRES_PORT)
+REPLICA_STICKY_SECONDS = int(os.getenv('REPLICA_STICKY_SECONDS', 5))
+
+# Cross-worker invalidation of the in-process caches over redis pub/sub. While the
+# subscriber is not connected local entries live CACHE_FALLBACK_TTL seconds at most
+CACHE_INVALIDATION = os.getenv('CACHE_INVALIDATION', 'true').lower() in ('1', 'true', 'yes')
+CACHE_FALLBACK_TTL = float(os.getenv('CACHE_FALLBACK_TTL', 1))
+
+# Connection pools: sized here, POOL_WARM connections of each are opened on
+# startup before the app reports ready, all of them are closed on shutdown
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 10))
+DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', 10))
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', 30))
+DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', 1800))
+DB_POOL_PRE_PING = os.getenv('DB_POOL_PRE_PING', 'true').lower() in ('1', 'true', 'yes')
+DB_POOL_WARM = int(os.getenv('DB_POOL_WARM', 5))
+REDIS_MAX_CONNECTIONS = int(os.getenv('REDIS_MAX_CONNECTIONS', 100))
+REDIS_POOL_TIMEOUT = float(os.getenv('REDIS_POOL_TIMEOUT', 5))
+REDIS_SOCKET_TIMEOUT = float(os.getenv('REDIS_SOCKET_TIMEOUT', 0.5))
+REDIS_POOL_WARM = int(os.getenv('REDIS_POOL_WARM', 5))
+
+# Redis circuit breaker: after REDIS_BREAKER_FAILURES consecutive errors redis is
+# skipped (ratings and votes go to postgres) for REDIS_BREAKER_RESET seconds
+REDIS_BREAKER_FAILURES = int(os.getenv('REDIS_BREAKER_FAILURES', 5))
+REDIS_BREAKER_RESET = float(os.getenv('REDIS_BREAKER_RESET', 5))
+
+# Max number of posts fetched or votes cast by a single batch request
+BATCH_MAX_SIZE = int(os.getenv('BATCH_MAX_SIZE', 100))
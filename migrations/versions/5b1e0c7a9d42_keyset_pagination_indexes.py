@@ -0,0 +1,28 @@
+"""Keyset pagination indexes
+
+Revision ID: 5b1e0c7a9d42
+Revises: 2773792c6942
+Create Date: 2026-10-18 10:12:31.402117
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5b1e0c7a9d42'
+down_revision = '2773792c6942'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_index('ix_user_created_at_uuid', 'user', ['created_at', 'uuid'], unique=False)
+    op.create_index('ix_post_created_at_id', 'post', ['created_at', 'id'], unique=False,
+                    postgresql_where=sa.text('published'))
+
+
+def downgrade() -> None:
+    op.drop_index('ix_post_created_at_id', table_name='post',
+                  postgresql_where=sa.text('published'))
+    op.drop_index('ix_user_created_at_uuid', table_name='user')
@@ -0,0 +1,26 @@
+"""Author feed and vote post_id indexes
+
+Revision ID: 9e4d2f61c8a3
+Revises: 5b1e0c7a9d42
+Create Date: 2026-10-18 14:03:52.771940
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9e4d2f61c8a3'
+down_revision = '5b1e0c7a9d42'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_index('ix_post_author_id_created_at_id', 'post', ['author_id', 'created_at', 'id'], unique=False)
+    op.create_index(op.f('ix_vote_post_id'), 'vote', ['post_id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_vote_post_id'), table_name='vote')
+    op.drop_index('ix_post_author_id_created_at_id', table_name='post')
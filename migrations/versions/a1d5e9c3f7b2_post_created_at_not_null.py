@@ -0,0 +1,26 @@
+"""Post created_at not null
+
+Revision ID: a1d5e9c3f7b2
+Revises: f4c2b8d6e9a1
+Create Date: 2026-10-18 21:12:36.847031
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a1d5e9c3f7b2'
+down_revision = 'f4c2b8d6e9a1'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # posts inserted without the ORM default; timestamps are naive UTC like datetime.utcnow
+    op.execute("UPDATE post SET created_at = now() AT TIME ZONE 'utc' WHERE created_at IS NULL")
+    op.alter_column('post', 'created_at', existing_type=sa.TIMESTAMP(), nullable=False)
+
+
+def downgrade() -> None:
+    op.alter_column('post', 'created_at', existing_type=sa.TIMESTAMP(), nullable=True)
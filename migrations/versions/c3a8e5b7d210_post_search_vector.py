@@ -0,0 +1,32 @@
+"""Post search vector
+
+Revision ID: c3a8e5b7d210
+Revises: 9e4d2f61c8a3
+Create Date: 2026-10-18 15:21:07.318554
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = 'c3a8e5b7d210'
+down_revision = '9e4d2f61c8a3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # stored generated column, postgres rewrites the table to fill it
+    op.add_column('post', sa.Column('search_vector', postgresql.TSVECTOR(), sa.Computed(
+        "setweight(to_tsvector('english', title), 'A') || "
+        "setweight(to_tsvector('english', content), 'B')", persisted=True), nullable=True))
+    op.create_index('ix_post_search_vector', 'post', ['search_vector'], unique=False,
+                    postgresql_using='gin', postgresql_where=sa.text('published'))
+
+
+def downgrade() -> None:
+    op.drop_index('ix_post_search_vector', table_name='post',
+                  postgresql_using='gin', postgresql_where=sa.text('published'))
+    op.drop_column('post', 'search_vector')
@@ -0,0 +1,75 @@
+"""Post vote counters
+
+Revision ID: e7f1a2b4c6d8
+Revises: c3a8e5b7d210
+Create Date: 2026-10-18 17:40:12.094386
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e7f1a2b4c6d8'
+down_revision = 'c3a8e5b7d210'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('post', sa.Column('likes_count', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('post', sa.Column('dislikes_count', sa.Integer(), server_default='0', nullable=False))
+
+    op.execute("""
+        CREATE FUNCTION post_vote_counters() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP = 'INSERT' THEN
+                UPDATE post SET likes_count = likes_count + NEW.is_like::int,
+                                dislikes_count = dislikes_count + (NOT NEW.is_like)::int
+                WHERE id = NEW.post_id;
+            ELSIF TG_OP = 'DELETE' THEN
+                UPDATE post SET likes_count = likes_count - OLD.is_like::int,
+                                dislikes_count = dislikes_count - (NOT OLD.is_like)::int
+                WHERE id = OLD.post_id;
+            ELSE
+                UPDATE post SET likes_count = likes_count + NEW.is_like::int - OLD.is_like::int,
+                                dislikes_count = dislikes_count + OLD.is_like::int - NEW.is_like::int
+                WHERE id = NEW.post_id;
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+    """)
+
+    # no votes may slip in between the trigger creation and the backfill
+    op.execute('LOCK TABLE vote IN SHARE ROW EXCLUSIVE MODE')
+    op.execute("""
+        CREATE TRIGGER vote_counters_insert_delete AFTER INSERT OR DELETE ON vote
+        FOR EACH ROW EXECUTE FUNCTION post_vote_counters()
+    """)
+    op.execute("""
+        CREATE TRIGGER vote_counters_update AFTER UPDATE OF is_like ON vote
+        FOR EACH ROW WHEN (OLD.is_like IS DISTINCT FROM NEW.is_like)
+        EXECUTE FUNCTION post_vote_counters()
+    """)
+    op.execute("""
+        UPDATE post SET likes_count = counts.likes, dislikes_count = counts.dislikes
+        FROM (SELECT post_id,
+                     count(*) FILTER (WHERE is_like) AS likes,
+                     count(*) FILTER (WHERE NOT is_like) AS dislikes
+              FROM vote GROUP BY post_id) AS counts
+        WHERE post.id = counts.post_id
+    """)
+
+    op.create_index('ix_post_rating', 'post',
+                    [sa.text('(likes_count - dislikes_count) DESC'), sa.text('id DESC')],
+                    unique=False, postgresql_where=sa.text('published'))
+
+
+def downgrade() -> None:
+    op.drop_index('ix_post_rating', table_name='post', postgresql_where=sa.text('published'))
+    op.execute('DROP TRIGGER vote_counters_update ON vote')
+    op.execute('DROP TRIGGER vote_counters_insert_delete ON vote')
+    op.execute('DROP FUNCTION post_vote_counters()')
+    op.drop_column('post', 'dislikes_count')
+    op.drop_column('post', 'likes_count')
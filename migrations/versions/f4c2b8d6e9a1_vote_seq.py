@@ -0,0 +1,25 @@
+"""Vote seq
+
+Revision ID: f4c2b8d6e9a1
+Revises: e7f1a2b4c6d8
+Create Date: 2026-10-18 19:05:43.512207
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f4c2b8d6e9a1'
+down_revision = 'e7f1a2b4c6d8'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # a constant default, no table rewrite
+    op.add_column('vote', sa.Column('seq', sa.BigInteger(), server_default='0', nullable=False))
+
+
+def downgrade() -> None:
+    op.drop_column('vote', 'seq')